@@ -0,0 +1,279 @@
+from typing import Any, Optional
+
+import asyncio
+import datetime
+import gc
+import itertools
+import json as JSON
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# (name, content) pairs fed through RACBot.on_message; {n} is replaced with a
+# number unique to each message, so API scenarios are not served from the cache
+scenarios: tuple[tuple[str, str], ...] = (
+    ('fun regionalify', '!!regionalify hello world 123'),
+    ('utility charinfo', '!!charinfo abc\N{SNOWMAN}'),
+    ('help', '!!help'),
+    ('iisr server info', '!!iisr server info {n}'),
+)
+
+snowflakes = itertools.count(1_000_000)
+
+
+class FakeHTTP:
+    """Answers the discord.py HTTPClient.request calls without a network."""
+
+    def __init__(self, bot_user: dict[str, Any], guild_id: int) -> None:
+        self.bot_user: dict[str, Any] = bot_user
+        self.guild_id: int = guild_id
+        self.calls: dict[str, int] = {}
+
+    async def request(self, route: Any, **kwargs: Any) -> Any:
+        key: str = f'{route.method} {route.path}'
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+        if route.method == 'POST' and route.path == '/channels/{channel_id}/messages':
+            payload: dict[str, Any] = kwargs.get('json') or {}
+            if 'form' in kwargs:
+                payload = JSON.loads(kwargs['form'][0]['value'])
+            return message_payload(
+                route.channel_id,
+                self.guild_id,
+                self.bot_user,
+                payload.get('content') or '',
+                embeds=payload.get('embeds') or []
+            )
+        if route.method == 'PATCH' and route.path == '/channels/{channel_id}/messages/{message_id}':
+            payload = kwargs.get('json') or {}
+            data: dict[str, Any] = message_payload(
+                route.channel_id, self.guild_id, self.bot_user, payload.get('content') or ''
+            )
+            data['id'] = route.url.rsplit('/', 1)[-1]
+            return data
+        return None
+
+
+def user_payload(user_id: int, name: str, *, bot: bool = False) -> dict[str, Any]:
+    return {
+        'id': str(user_id),
+        'username': name,
+        'global_name': name,
+        'discriminator': '0',
+        'avatar': None,
+        'bot': bot,
+    }
+
+
+def message_payload(
+    channel_id: int,
+    guild_id: int,
+    author: dict[str, Any],
+    content: str,
+    *,
+    embeds: Optional[list[dict[str, Any]]] = None
+) -> dict[str, Any]:
+    return {
+        'id': str(next(snowflakes)),
+        'channel_id': str(channel_id),
+        'guild_id': str(guild_id),
+        'author': author,
+        'member': {
+            'roles': [],
+            'joined_at': '2024-01-01T00:00:00+00:00',
+            'deaf': False,
+            'mute': False,
+            'flags': 0,
+        },
+        'content': content,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'mention_roles': [],
+        'attachments': [],
+        'embeds': embeds or [],
+        'pinned': False,
+        'type': 0,
+    }
+
+
+class Harness:
+    def __init__(self, bot) -> None:
+        import discord
+
+        self.bot = bot
+        self.guild_id: int = next(snowflakes)
+        self.channel_id: int = next(snowflakes)
+        bot_user: dict[str, Any] = user_payload(next(snowflakes), 'RAC Bot', bot=True)
+
+        state = bot._connection
+        state.user = discord.ClientUser(state=state, data=bot_user)
+        guild = discord.Guild(
+            state=state,
+            data={
+                'id': str(self.guild_id),
+                'name': 'bench',
+                'owner_id': bot_user['id'],
+                'roles': [{'id': str(self.guild_id), 'name': '@everyone', 'permissions': str(2 ** 53 - 1)}],
+                'channels': [{'id': str(self.channel_id), 'type': 0, 'name': 'bench', 'position': 0}],
+                'members': [{
+                    'user': bot_user,
+                    'roles': [],
+                    'joined_at': '2024-01-01T00:00:00+00:00',
+                    'deaf': False,
+                    'mute': False,
+                    'flags': 0,
+                }],
+                'member_count': 1,
+            }
+        )
+        state._add_guild(guild)
+
+        self.http: FakeHTTP = FakeHTTP(bot_user, self.guild_id)
+        bot.http.request = self.http.request
+        # is_owner would otherwise ask the API for the application info
+        bot.owner_id = next(snowflakes)
+
+    def message(self, content: str):
+        import discord
+
+        # a fresh author each time so per-user cooldowns never kick in
+        author: dict[str, Any] = user_payload(next(snowflakes), 'kaog')
+        content = content.replace('{n}', str(next(snowflakes)))
+        data: dict[str, Any] = message_payload(self.channel_id, self.guild_id, author, content)
+        channel = self.bot.get_channel(self.channel_id)
+        return discord.Message(state=self.bot._connection, channel=channel, data=data)
+
+    async def run(self, content: str, *, iterations: int, concurrency: int) -> dict[str, Any]:
+        latencies: list[float] = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one() -> None:
+            message = self.message(content)
+            async with semaphore:
+                started: float = time.perf_counter()
+                await self.bot.on_message(message)
+                latencies.append(time.perf_counter() - started)
+
+        started: float = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(iterations)))
+        elapsed: float = time.perf_counter() - started
+
+        ordered: list[float] = sorted(latencies)
+        return {
+            'iterations': iterations,
+            'concurrency': concurrency,
+            'throughput': iterations / elapsed if elapsed else 0.0,
+            'p50_ms': statistics.median(ordered) * 1000,
+            'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+            'mean_ms': statistics.fmean(ordered) * 1000,
+        }
+
+    async def allocations(self, content: str, *, iterations: int) -> dict[str, Any]:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before: int = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+            tracemalloc.reset_peak()
+            for _ in range(iterations):
+                await self.bot.on_message(self.message(content))
+            _, peak = tracemalloc.get_traced_memory()
+            after: int = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'peak_kib': peak / 1024,
+            'retained_blocks_per_command': (after - before) / iterations,
+        }
+
+
+async def api_hits(port: int) -> dict[str, int]:
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'http://127.0.0.1:{port}/_standin/stats') as response:
+            return (await response.json())['hits']
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(
+    *,
+    iterations: int = 500,
+    concurrency: int = 16,
+    api_latency: float = 0.0,
+    port: int = 8099,
+    only: Optional[list[str]] = None
+) -> dict[str, Any]:
+    os.environ['RAC_API_URL'] = f'http://127.0.0.1:{port}/'
+    # measure the command pipeline, not client-side caps set for production
+    os.environ['RAC_RATE_LIMITS'] = ''
+    os.environ.setdefault('RAC_OUTBOX_PATH', ':memory:')
+    os.environ.setdefault('RAC_IMAGE_CACHE_PATH', tempfile.mkdtemp(prefix='racbot-bench-'))
+    os.environ.setdefault('RAC_CONVERSATIONS_PATH', ':memory:')
+
+    # imported late so the endpoints are built against the stand-in
+    import discord
+    from racbot import RACBot
+    from standin import StandInSettings, serve
+
+    runner = await serve('127.0.0.1', port, StandInSettings(latency=api_latency, seed=0))
+    bot = RACBot()
+    try:
+        await bot._async_setup_hook()
+        await bot.setup_hook()
+        harness = Harness(bot)
+
+        results: dict[str, Any] = {}
+        for name, content in scenarios:
+            if only and name not in only:
+                continue
+            # one warm-up pass so import and cache costs are not measured
+            await harness.run(content, iterations=min(20, iterations), concurrency=concurrency)
+            before: dict[str, int] = await api_hits(port)
+            result: dict[str, Any] = await harness.run(content, iterations=iterations, concurrency=concurrency)
+            after: dict[str, int] = await api_hits(port)
+            # how many commands actually reached the API rather than the cache
+            result['api_hits'] = {
+                endpoint: after[endpoint] - before.get(endpoint, 0)
+                for endpoint in after if after[endpoint] != before.get(endpoint, 0)
+            }
+            result.update(await harness.allocations(content, iterations=min(100, iterations)))
+            results[name] = result
+            log.info('%s: %.0f cmd/s, p50 %.2f ms, p99 %.2f ms', name, result['throughput'], result['p50_ms'], result['p99_ms'])
+        total_hits: dict[str, int] = await api_hits(port)
+    finally:
+        await bot.close()
+        await runner.cleanup()
+
+    return {
+        'revision': git_revision(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'discord.py': discord.__version__,
+        'api_latency': api_latency,
+        'commands': results,
+        'http_calls': harness.http.calls,
+        'api_hits': total_hits,
+    }
+
+
+def write_results(results: dict[str, Any], path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as fp:
+        JSON.dump(results, fp, indent=2, sort_keys=True)
@@ -1,16 +1,22 @@
-from typing import Union
+from typing import Union, Any, Optional
 
 import discord
 from discord.ext import commands
 from discord import app_commands
 
+import aiohttp
 import asyncio
 import io
 
 from racbot import RACBot
 from utils.context import Context
 from utils.enums import Endpoints, api_headers
+from utils.conversations import Conversation, ConversationStore
 from utils.exceptions import HTTPException, GeneralException
+from utils.imagestore import ImageStore, image_format
+from utils.promptcache import PromptCache
+from utils.scheduler import FairScheduler
+from utils.streaming import EventStream, ProgressiveReply, response_text
 
 
 @app_commands.allowed_installs(guilds=True, users=True)
@@ -20,15 +26,51 @@ class AI(commands.GroupCog, group_name='ai'):
 
     def __init__(self, bot: RACBot) -> None:
         self.bot: RACBot = bot
-        self.get_body = bot.functions.get_body
-        self.request = bot.functions.endpoint_request
-        self.image_request = bot.functions.image_request
+        self.api = bot.api
+        self.prompt_cache: PromptCache = bot.prompt_cache
+        self.images: ImageStore = bot.images
+        self.conversations: ConversationStore = bot.conversations
+        self.scheduler: FairScheduler = FairScheduler(concurrency=4, max_queue=50)
         self.variables = bot.variables
 
     @property
     def display_emoji(self) -> discord.PartialEmoji:
         return discord.PartialEmoji(name='\N{ROBOT FACE}')
 
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        # deleting the command message drops its queued or running AI request
+        self.scheduler.cancel(payload.message_id, self.bot.functions)
+
+    async def stream_reply(self, ctx: Context, endpoint: Endpoints, json: dict[str, Any]) -> None:
+        guild_id: Optional[int] = ctx.guild.id if ctx.guild else None
+        cached: Optional[str] = self.prompt_cache.get(guild_id, endpoint, json)
+        if cached is not None:
+            await ProgressiveReply(ctx).finish(f'{cached}\n-# cached answer')
+            return
+
+        reply = ProgressiveReply(ctx)
+        async with self.scheduler.slot(ctx):
+            body: Union[EventStream, dict[str, Any]] = await self.api.stream(endpoint, 'post', json=json)
+            if isinstance(body, dict):
+                await reply.feed(response_text(body))
+            else:
+                try:
+                    async with body:
+                        async for delta in body.text():
+                            await reply.feed(delta)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if not reply.messages:
+                        raise
+                    # keep what already arrived rather than replacing it with an error
+                    await reply.finish('\n\n*(response was cut off)*')
+                    return
+
+        messages: list[discord.Message] = await reply.finish()
+        if not messages:
+            return await ctx.handle_error_no_http('API did not return a response')
+        self.prompt_cache.set(guild_id, endpoint, json, reply.text)
+
     @commands.hybrid_command()
     @commands.cooldown(1, 2.5, commands.BucketType.user)
     async def gemini(self, ctx: Context, *, prompt: str):
@@ -45,36 +87,12 @@ class AI(commands.GroupCog, group_name='ai'):
 
         json: dict[str, Union[str, bool]] = {
             'prompt': prompt,
-            'debug': False
+            'debug': False,
+            'stream': True
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(Endpoints.ai_gemini_create, 'post', json=json, headers=api_headers),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    return await ctx.handle_error_body(status, body, reason)
-                
-                if type(body) == dict:
-                    response: Union[str, None] = body.get('response')
-                    if not response:
-                        return await ctx.handle_error_no_http('API did not return a response')
-                    
-                    if len(response) > 2000:
-                        message = await ctx.reply(response[:2000])
-                        await message.reply(response[2000:])
-                    else:
-                        await ctx.reply(response)
-                else:
-                    raise GeneralException('Response mimetype was not application/json')
+            await self.stream_reply(ctx, Endpoints.ai_gemini_create, json)
 
     @commands.hybrid_command()
     @commands.cooldown(1, 2.5, commands.BucketType.user)
@@ -90,30 +108,88 @@ class AI(commands.GroupCog, group_name='ai'):
             !!hermes 2+2
         """
 
-        json: dict[str, str] = {
-            'prompt': prompt
+        json: dict[str, Union[str, bool]] = {
+            'prompt': prompt,
+            'stream': True
         }
 
         async with ctx.typing():
+            await self.stream_reply(ctx, Endpoints.ai_cloudflare_text_create, json)
+
+    @commands.hybrid_command()
+    @commands.cooldown(1, 2.5, commands.BucketType.user)
+    async def chat(self, ctx: Context, *, prompt: str):
+        """Chat with an AI that remembers your conversation in this channel
+
+        Args:
+            ctx (Context): _description_
+            prompt (str): The next message in the conversation
+
+        Usage:
+            !!chat my name is kaog
+            !!chat what is my name?
+        """
+
+        key: str = self.conversations.key(ctx.channel.id, ctx.author.id)
+        conversation: Conversation = await self.conversations.get(key)
+
+        async with ctx.typing(), conversation.lock, self.scheduler.slot(ctx):
             try:
-                request = await asyncio.wait_for(
-                    self.request(Endpoints.ai_cloudflare_text_create, 'post', json=json, headers=api_headers),
-                    timeout=30
+                body: dict[str, Any] = await self.api.json(
+                    Endpoints.ai_cai_create, 'post', json=conversation.request(prompt)
                 )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    return await ctx.handle_error_body(status, body, reason)
-                
-                if type(body) == dict:
-                    response: str = body['result']['response']
-                    await ctx.reply(response)
-                else:
-                    raise GeneralException('Response mimetype was not application/json')
+            except HTTPException as e:
+                if e.status != 404 or not conversation.conversation_id:
+                    raise
+                # the API forgot this conversation, start a new one from what we remember
+                conversation.conversation_id = None
+                body = await self.api.json(Endpoints.ai_cai_create, 'post', json=conversation.request(prompt))
+
+            response: str = response_text(body)
+            if not response:
+                return await ctx.handle_error_no_http('API did not return a response')
+            await self.conversations.record(conversation, prompt, response, body.get('conversation_id'))
+
+        await ProgressiveReply(ctx).finish(response)
+
+    @commands.hybrid_command(name='chat-reset')
+    async def chat_reset(self, ctx: Context):
+        """Forget your conversation with the AI in this channel
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        await self.conversations.reset(self.conversations.key(ctx.channel.id, ctx.author.id))
+        await ctx.reply('ok, I forgot our conversation in this channel')
+
+    @commands.hybrid_command(name='chat-history')
+    @commands.cooldown(1, 5, commands.BucketType.user)
+    async def chat_history(self, ctx: Context):
+        """Show what the AI remembers of your conversation in this channel
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        key: str = self.conversations.key(ctx.channel.id, ctx.author.id)
+        conversation: Conversation = await self.conversations.get(key)
+        turns: list[dict[str, str]] = [turn.to_dict() for turn in conversation.turns]
+        if not turns and conversation.conversation_id:
+            body: dict[str, Any] = await self.api.json(
+                Endpoints.ai_cai_history, params={'conversation_id': conversation.conversation_id}
+            )
+            turns = body.get('history', [])
+        if not turns:
+            return await ctx.reply('We have not talked in this channel yet')
+
+        lines: list[str] = []
+        if conversation.summary:
+            lines.append(f'-# earlier: {discord.utils.remove_markdown(conversation.summary)[:300]}')
+        for turn in turns[-8:]:
+            name: str = ctx.author.display_name if turn.get('role') == 'user' else 'AI'
+            lines.append(f'**{name}:** {str(turn.get("content", ""))[:150]}')
+        await ctx.reply('\n'.join(lines), allowed_mentions=discord.AllowedMentions.none())
 
     @commands.hybrid_command()
     @commands.cooldown(1, 2.5, commands.BucketType.user)
@@ -138,32 +214,119 @@ class AI(commands.GroupCog, group_name='ai'):
         }
 
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.image_request(Endpoints.ai_cloudflare_image_create, 'post', json=json, headers=api_headers),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    return await ctx.handle_error_body(status, body, reason)
-                
-                if type(body) == bytes:
-                    image_file = io.BytesIO(body)
-                    file = discord.File(image_file, filename='imagine.png')
-                    
-                    embed = discord.Embed()
-                    embed.description = f'Prompt: {prompt}'
-                    embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
-                    embed.set_image(url='attachment://imagine.png')
-
-                    await ctx.reply(file=file, embed=embed)
-                else:
-                    raise GeneralException('Response mimetype was not image/png')
+            key, image = await self.images.image(
+                self.api, 
+                Endpoints.ai_cloudflare_image_create, 
+                'post', 
+                json=json, 
+                slot=self.scheduler.slot(ctx)
+            )
+
+            embed = discord.Embed()
+            embed.description = f'Prompt: {prompt}'
+            embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
+
+            # the same prompt was uploaded before, link it instead of sending it again
+            if isinstance(image, str):
+                embed.set_image(url=image)
+                return await ctx.reply(embed=embed)
+
+            filename: str = f'imagine.{image_format(image)}'
+            file = discord.File(image, filename=filename)
+            embed.set_image(url=f'attachment://{filename}')
+            message: discord.Message = await ctx.reply(file=file, embed=embed)
+            await self.images.remember(key, message)
+
+    @commands.hybrid_group(name='prompt-cache', fallback='status', invoke_without_command=True)
+    @commands.guild_only()
+    async def ai_cache(self, ctx: Context):
+        """Show whether repeated prompts are answered from the cache here
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        if not self.prompt_cache.enabled:
+            return await ctx.reply('The prompt cache is turned off for the whole bot')
+
+        stats: dict[str, Any] = self.prompt_cache.stats()
+        state: str = 'on' if self.prompt_cache.active(ctx.guild.id) else 'off'
+        await ctx.reply(
+            f'Prompt cache is **{state}** in this server '
+            f'({stats["entries"]} answers cached, {stats["hit_rate"]:.0%} hit rate)'
+        )
+
+    @ai_cache.command(name='off')
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def ai_cache_off(self, ctx: Context):
+        """Always ask the AI instead of reusing cached answers in this server
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        await self.prompt_cache.set_opt_in(ctx.guild.id, False)
+        await ctx.reply('ok, AI answers will no longer be cached in this server')
+
+    @ai_cache.command(name='on')
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def ai_cache_on(self, ctx: Context):
+        """Reuse cached answers for repeated prompts in this server
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        if not self.prompt_cache.enabled:
+            return await ctx.reply('The prompt cache is turned off for the whole bot')
+
+        await self.prompt_cache.set_opt_in(ctx.guild.id, True)
+        await ctx.reply('ok, repeated prompts will be answered from the cache in this server')
+
+    @commands.hybrid_group(name='message-scan', fallback='status', invoke_without_command=True)
+    @commands.guild_only()
+    async def ai_moderation(self, ctx: Context):
+        """Show whether messages in this server are checked by the AI moderation model
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        channel_id: Optional[int] = self.bot.moderation.report_channel(ctx.guild.id)
+        if channel_id is None:
+            return await ctx.reply('Moderation is **off** in this server')
+        await ctx.reply(f'Moderation is **on** in this server, flagged messages are reported to <#{channel_id}>')
+
+    @ai_moderation.command(name='on')
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def ai_moderation_on(self, ctx: Context, channel: discord.TextChannel):
+        """Check messages in this server and report flagged ones to a channel
+
+        Args:
+            ctx (Context): _description_
+            channel (discord.TextChannel): Where flagged messages from this server are reported
+        """
+
+        if channel.guild.id != ctx.guild.id:
+            raise HTTPException(422, 'The report channel must be in this server')
+        await self.bot.moderation.set_channel(ctx.guild.id, channel.id)
+        await ctx.reply(f'ok, flagged messages in this server will be reported to {channel.mention}')
+
+    @ai_moderation.command(name='off')
+    @commands.guild_only()
+    @commands.has_guild_permissions(manage_guild=True)
+    async def ai_moderation_off(self, ctx: Context):
+        """Stop checking messages in this server
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        await self.bot.moderation.set_channel(ctx.guild.id, None)
+        await ctx.reply('ok, messages in this server will no longer be checked')
 
 
 async def setup(bot: RACBot):
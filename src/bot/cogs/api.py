@@ -9,11 +9,33 @@ import asyncio
 import json as JSON
 import time
 import io
+import contextlib
+import datetime
+from collections import deque
 
 from racbot import RACBot
-from utils.context import Context
+from utils.context import Context, GuildContext
 from utils.enums import Endpoints, api_headers
 from utils.exceptions import GeneralException, HTTPException
+from utils.imagestore import ImageStore, image_format
+from utils.ratelimit import TokenBucket
+from utils.wordcount import WordCounter, word_frequencies
+
+
+wordcloud_max_messages: int = 50000
+# a cloud has no room for more words than this
+wordcloud_max_words: int = 1000
+# words kept while counting big windows, everything past it is too rare to show
+wordcloud_max_distinct: int = 20000
+# messages read ahead of the counting
+wordcloud_prefetch: int = 500
+wordcloud_progress_interval: float = 3.0
+# history iterators open at once for a server wordcloud, each on its own channel
+wordcloud_server_concurrency: int = 4
+# pages per second across every server scan, well under Discord's global 50 requests a second
+wordcloud_server_page_rate: float = 10.0
+wordcloud_server_channel_messages: int = 2000
+wordcloud_server_deadline: float = 120.0
 
 
 class API(commands.Cog):
@@ -21,10 +43,13 @@ class API(commands.Cog):
 
     def __init__(self, bot: RACBot) -> None:
         self.bot: RACBot = bot
-        self.get_body = bot.functions.get_body
-        self.request = bot.functions.endpoint_request
-        self.image_request = bot.functions.image_request
+        self.api = bot.api
+        self.images: ImageStore = bot.images
         self.variables = bot.variables
+        # shared by every server scan, one history page a token
+        self.history_bucket: TokenBucket = TokenBucket(
+            'history', wordcloud_server_page_rate, wordcloud_server_concurrency
+        )
 
     @property
     def display_emoji(self) -> discord.PartialEmoji:
@@ -42,30 +67,10 @@ class API(commands.Cog):
 
         start_time: float = time.time()
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.utility_ping, 
-                        'get',
-                        headers=api_headers
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                if type(body) == dict:
-                    end_time: float = body['time']
-                    total: float = end_time - start_time
-                    await ctx.reply(f'took {total:.2f} seconds')
-                else:
-                    raise GeneralException('Response mimetype was not application/json')
+            body: dict[str, Any] = await self.api.json(Endpoints.utility_ping, 'get')
+            end_time: float = body['time']
+            total: float = end_time - start_time
+            await ctx.reply(f'took {total:.2f} seconds')
                 
     @commands.group(invoke_without_command=True)
     async def usage(self, ctx: Context):
@@ -78,36 +83,123 @@ class API(commands.Cog):
         """Get the process usage of the API"""
 
         async with ctx.typing():
+            body: dict[str, Any] = await self.api.json(Endpoints.utility_usage, 'get')
+            main: dict = body['main']
+            storage: dict = body['storage']
+            cpu_usage: str = main['cpu']
+            rss_mem: str = main['rssMem']
+            vms_mem: str = main['vmsMem']
+
+            await ctx.reply(f'CPU: `{cpu_usage}`\nRSS MEMORY: `{rss_mem}`\nVMS MEMORY: `{vms_mem}`')
+                
+    async def edit_progress(self, message: discord.Message, content: str) -> None:
+        with contextlib.suppress(discord.HTTPException):
+            await message.edit(content=content)
+
+    async def delete_progress(self, message: discord.Message) -> None:
+        with contextlib.suppress(discord.HTTPException):
+            await message.delete()
+
+    async def stream_counts(
+        self,
+        ctx: Context,
+        counter: WordCounter,
+        before: int,
+        max_messages: int
+    ) -> Optional[discord.Message]:
+        """Counts the messages before ``before`` into ``counter`` as they arrive.
+
+        The history is read a few pages ahead of the counting, and only the
+        contents wait in between. Returns the progress message, if one was
+        needed.
+        """
+
+        queue: asyncio.Queue[Union[str, Exception, None]] = asyncio.Queue(maxsize=wordcloud_prefetch)
+
+        async def read() -> None:
             try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.utility_usage, 
-                        'get',
-                        headers=api_headers
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
+                async for message in ctx.channel.history(
+                    limit=max_messages - counter.messages, before=discord.Object(id=before)
+                ):
+                    await queue.put(message.content)
             except Exception as e:
-                raise commands.CommandInvokeError(e)
+                await queue.put(e)
             else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                if type(body) == dict:
-                    main: dict = body['main']
-                    storage: dict = body['storage']
-                    cpu_usage: str = main['cpu']
-                    rss_mem: str = main['rssMem']
-                    vms_mem: str = main['vmsMem']
-
-                    await ctx.reply(f'CPU: `{cpu_usage}`\nRSS MEMORY: `{rss_mem}`\nVMS MEMORY: `{vms_mem}`')
+                await queue.put(None)
+
+        reader: asyncio.Task = asyncio.create_task(read())
+        progress: Optional[discord.Message] = None
+        editing: Optional[asyncio.Task] = None
+        last_progress: float = time.monotonic()
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                counter.update(item)
+
+                now: float = time.monotonic()
+                if now - last_progress < wordcloud_progress_interval or (editing and not editing.done()):
+                    continue
+                last_progress = now
+                content: str = f'Reading messages... {counter.messages:,}/{max_messages:,}'
+                if progress is None:
+                    progress = await ctx.reply(content)
                 else:
-                    raise GeneralException('Response mimetype was not application/json')
-                
-    @commands.command()
+                    editing = asyncio.create_task(self.edit_progress(progress, content))
+        finally:
+            reader.cancel()
+        return progress
+
+    async def send_wordcloud(
+        self,
+        ctx: Context,
+        frequencies: dict[str, int],
+        max_words: int,
+        progress: Optional[discord.Message] = None,
+        description: Optional[str] = None
+    ) -> None:
+        if not frequencies:
+            raise HTTPException(422, 'Not enough words for a wordcloud')
+        json: dict[str, Union[dict[str, int], int]] = {
+            'frequencies': frequencies,
+            'max_words': max_words
+        }
+
+        rendering: Optional[asyncio.Task] = None
+        if progress is not None:
+            rendering = asyncio.create_task(self.edit_progress(progress, 'Rendering the wordcloud...'))
+
+        try:
+            # unchanged counts hash to the same key and are not rendered again
+            key, image = await self.images.image(self.api, Endpoints.fun1_wordcloud, 'post', json=json)
+
+            embed = discord.Embed()
+            embed.description = description
+            embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
+
+            if isinstance(image, str):
+                embed.set_image(url=image)
+                send = ctx.reply(embed=embed)
+            else:
+                filename: str = f'wordcloud.{image_format(image)}'
+                embed.set_image(url=f'attachment://{filename}')
+                send = ctx.reply(file=discord.File(image, filename=filename), embed=embed)
+
+            if progress is None or rendering is None:
+                message: discord.Message = await send
+            else:
+                await rendering
+                # the upload and the progress cleanup go out together
+                message, _ = await asyncio.gather(send, self.delete_progress(progress))
+        finally:
+            # a failed render or upload must not leave the progress edit behind
+            if rendering is not None:
+                rendering.cancel()
+                await asyncio.gather(rendering, return_exceptions=True)
+        if not isinstance(image, str):
+            await self.images.remember(key, message)
+
+    @commands.group(invoke_without_command=True)
     @commands.cooldown(1, 3, commands.BucketType.user)
     async def wordcloud(self, ctx: Context, max_messages: int = 500):
         """Generate a wordcloud in a channel
@@ -117,48 +209,152 @@ class API(commands.Cog):
             max_messages (int, optional): The max amount of messages to get. Defaults to 500.
         """
 
-        if max_messages > 1000:
-            raise HTTPException(422, 'Maximum messages parameter too large (1000)')
+        if max_messages > wordcloud_max_messages:
+            raise HTTPException(422, f'Maximum messages parameter too large ({wordcloud_max_messages})')
         if max_messages < 50:
             raise HTTPException(422, 'Maximum messages parameter too small (50)')
-        
-        channel_history: list[discord.Message] = []
-        async with ctx.typing():
-            async for message in ctx.channel.history(limit=max_messages):
-                channel_history.append(message)
-            
-            text = ' '.join([message.content for message in channel_history])
-            json: dict[str, Union[str, int]] = {
-                'text': text,
-                'max_words': max_messages
-            }
 
-            try:
-                request = await asyncio.wait_for(
-                    self.image_request(Endpoints.fun1_wordcloud, 'post', json=json, headers=api_headers),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
+        max_words: int = min(max_messages, wordcloud_max_words)
+        progress: Optional[discord.Message] = None
+        async with ctx.typing():
+            # only the messages the buffer has not seen are read from the history
+            contents, oldest = await self.bot.message_buffer.window(ctx.channel, max_messages)
+            if len(contents) < max_messages and len(contents) == self.bot.message_buffer.max_messages:
+                # past what the buffer keeps, messages are counted and let go as they arrive
+                counter = WordCounter(max_distinct=wordcloud_max_distinct)
+                counter.update_many(contents)
+                del contents
+                progress = await self.stream_counts(ctx, counter, oldest, max_messages)
+                frequencies: dict[str, int] = counter.top(max_words)
             else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    return await ctx.handle_error_body(status, body, reason)
-                
-                if type(body) == bytes:
-                    image_file = io.BytesIO(body)
-                    file = discord.File(image_file, filename='wordcloud.png')
+                # the counts are all the cloud needs, and far smaller than the text
+                frequencies = await word_frequencies(contents, max_words)
+
+            await self.send_wordcloud(ctx, frequencies, max_words, progress)
+
+    def readable_channels(self, ctx: GuildContext, cutoff: datetime.datetime) -> list[discord.abc.Messageable]:
+        channels: list[Union[discord.TextChannel, discord.Thread]] = [*ctx.guild.text_channels, *ctx.guild.threads]
+        readable: list[discord.abc.Messageable] = []
+        for channel in channels:
+            # nothing sent since the cutoff, so there is nothing to read
+            if channel.last_message_id is None or discord.utils.snowflake_time(channel.last_message_id) < cutoff:
+                continue
+            # the cloud must not show words from channels the author cannot see
+            mine: discord.Permissions = channel.permissions_for(ctx.me)
+            theirs: discord.Permissions = channel.permissions_for(ctx.author)
+            if mine.read_message_history and mine.view_channel and theirs.read_message_history and theirs.view_channel:
+                readable.append(channel)
+        # busiest first, so a scan that runs out of time has read the channels that matter most
+        readable.sort(key=lambda channel: channel.last_message_id or 0, reverse=True)
+        return readable
+
+    async def scan_channel(
+        self,
+        channel: discord.abc.Messageable,
+        cutoff: datetime.datetime,
+        counter: WordCounter
+    ) -> None:
+        """Counts the channel's messages back to ``cutoff``, a page at a time.
+
+        Every page waits for a token from the shared history bucket first.
+        """
 
-                    embed = discord.Embed()
-                    embed.set_author(name=ctx.author.name, icon_url=ctx.author.display_avatar.url)
-                    embed.set_image(url='attachment://wordcloud.png')
+        before: Optional[discord.abc.Snowflake] = None
+        read: int = 0
+        while read < wordcloud_server_channel_messages:
+            await self.history_bucket.acquire()
+            limit: int = min(100, wordcloud_server_channel_messages - read)
+            page: list[discord.Message] = [
+                message async for message in channel.history(limit=limit, before=before)
+            ]
+            for message in page:
+                if message.created_at < cutoff:
+                    return
+                counter.update(message.content)
+            read += len(page)
+            if len(page) < limit:
+                return
+            before = page[-1]
 
-                    await ctx.reply(file=file, embed=embed)
+    @wordcloud.command(name='server')
+    @commands.guild_only()
+    @commands.cooldown(1, 60, commands.BucketType.guild)
+    @commands.max_concurrency(1, commands.BucketType.guild)
+    async def wordcloud_server(self, ctx: GuildContext, days: int = 7):
+        """Generate a wordcloud from every channel and thread in the server
+
+        Args:
+            ctx (Context): _description_
+            days (int, optional): How many days back to read in each channel. Defaults to 7.
+        """
+
+        if days > 30:
+            raise HTTPException(422, 'Days parameter too large (30)')
+        if days < 1:
+            raise HTTPException(422, 'Days parameter too small (1)')
+
+        cutoff: datetime.datetime = discord.utils.utcnow() - datetime.timedelta(days=days)
+        channels: list[discord.abc.Messageable] = self.readable_channels(ctx, cutoff)
+        if not channels:
+            raise HTTPException(404, f'No channels you can read have messages from the last {days} days')
+
+        total = WordCounter(max_distinct=wordcloud_max_distinct)
+        pending: deque[discord.abc.Messageable] = deque(channels)
+        scanned: list[int] = [0]
+        partial: list[int] = [0]
+        failed: list[int] = [0]
+
+        async def worker() -> None:
+            while pending:
+                channel: discord.abc.Messageable = pending.popleft()
+                counter = WordCounter(max_distinct=wordcloud_max_distinct)
+                try:
+                    await self.scan_channel(channel, cutoff, counter)
+                except discord.HTTPException:
+                    failed[0] += 1
+                except asyncio.CancelledError:
+                    partial[0] += 1
+                    raise
                 else:
-                    raise GeneralException('Response mimetype was not image/png')
-                
+                    scanned[0] += 1
+                finally:
+                    # a channel cut short by the deadline or an error still adds what it read
+                    total.merge(counter)
+
+        progress: discord.Message = await ctx.reply(f'Scanning {len(channels)} channels...')
+        last_progress: float = time.monotonic()
+        workers: list[asyncio.Task] = [
+            asyncio.create_task(worker()) for _ in range(min(wordcloud_server_concurrency, len(channels)))
+        ]
+        deadline: float = time.monotonic() + wordcloud_server_deadline
+        try:
+            async with ctx.typing():
+                while not all(task.done() for task in workers) and time.monotonic() < deadline:
+                    await asyncio.wait(workers, timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+                    if time.monotonic() - last_progress >= wordcloud_progress_interval:
+                        last_progress = time.monotonic()
+                        await self.edit_progress(
+                            progress,
+                            f'Scanning channels... {scanned[0]}/{len(channels)} done, {total.messages:,} messages read'
+                        )
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        notes: list[str] = [f'{total.messages:,} messages over the last {days} days, {scanned[0]} channels read in full']
+        unread: int = len(channels) - scanned[0] - partial[0] - failed[0]
+        if partial[0] or unread:
+            notes.append(
+                f'stopped after {wordcloud_server_deadline:.0f}s, {partial[0]} channels only partly read '
+                f'and {unread} not read'
+            )
+        if failed[0]:
+            notes.append(f'{failed[0]} channels could not be read')
+        max_words: int = wordcloud_max_words
+        async with ctx.typing():
+            await self.send_wordcloud(ctx, total.top(max_words), max_words, progress, '\n'.join(notes))
+
 
 async def setup(bot: RACBot):
     await bot.add_cog(API(bot))
\ No newline at end of file
@@ -11,6 +11,8 @@ from contextlib import redirect_stdout
 
 from racbot import RACBot, extensions
 from utils.context import Context, GuildContext
+from utils.enums import Endpoints
+from utils import codec
 
 
 class Owner(commands.Cog):
@@ -212,6 +214,172 @@ class Owner(commands.Cog):
             else:
                 await msg.reply(f'Successfully synced {len(commands)} commands')
 
+    @commands.command()
+    @commands.is_owner()
+    async def pool(self, ctx: Context):
+        """Shows the API connection pool stats"""
+
+        stats: dict[str, Any] = self.bot.pool_stats.to_dict()
+        lines: list[str] = [
+            f'{key:<16}{value:.2f}' if isinstance(value, float) else f'{key:<16}{value}'
+            for key, value in stats.items()
+        ]
+        joined: str = '\n'.join(lines)
+        await ctx.reply(f'```\n{joined}```')
+
+    @commands.group(invoke_without_command=True)
+    @commands.is_owner()
+    async def cache(self, ctx: Context):
+        """Shows the API response cache stats"""
+
+        stats: dict[str, Any] = self.bot.functions.cache.stats()
+        stats['coalesced'] = self.bot.functions.coalesced
+        stats['in_flight'] = len(self.bot.functions._inflight)
+        lines: list[str] = [
+            f'{key:<16}{value:.2f}' if isinstance(value, float) else f'{key:<16}{value}'
+            for key, value in stats.items()
+        ]
+        lines.append('\nimages')
+        lines.extend(f'{key:<16}{value}' for key, value in self.bot.images.stats().items())
+        lines.append('\nmessage buffer')
+        lines.extend(f'{key:<16}{value}' for key, value in self.bot.message_buffer.stats().items())
+        lines.append('\nconversations')
+        lines.extend(f'{key:<16}{value}' for key, value in self.bot.conversations.stats().items())
+        encoder = self.bot.images.encoder
+        if encoder is not None:
+            lines.append(f'\nre-encoding to {encoder.format}' + ('' if encoder.available else ' (Pillow missing)'))
+            lines.extend(
+                f'{key:<16}{value:.2f}' if isinstance(value, float) else f'{key:<16}{value}'
+                for key, value in encoder.stats.to_dict().items()
+            )
+        joined: str = '\n'.join(lines)
+        await ctx.reply(f'```\n{joined}```')
+
+    @cache.command(name='clear')
+    @commands.is_owner()
+    async def cache_clear(self, ctx: Context, endpoint: Optional[str] = None):
+        """Clears the API response cache, or a single endpoint from it"""
+
+        if endpoint is None:
+            self.bot.functions.cache.clear()
+            return await ctx.reply('cleared the cache')
+
+        try:
+            removed: int = self.bot.functions.invalidate(Endpoints[endpoint])
+        except KeyError:
+            return await ctx.handle_error(404, f'Unknown endpoint `{endpoint}`')
+        await ctx.reply(f'cleared {removed} entries for `{endpoint}`')
+
+    @commands.command()
+    @commands.is_owner()
+    async def codec(self, ctx: Context):
+        """Shows the API body encode/decode timings"""
+
+        lines: list[str] = [f'backend: {codec.backend}', f'{"kind":<13}{"count":<8}{"bytes":<12}{"avg ms":<9}max ms']
+        for kind, stats in codec.stats.to_dict().items():
+            lines.append(
+                f'{kind:<13}{stats["count"]:<8.0f}{stats["bytes"]:<12.0f}{stats["avg_ms"]:<9.3f}{stats["max_ms"]:.3f}'
+            )
+        joined: str = '\n'.join(lines)
+        await ctx.reply(f'```\n{joined}```')
+
+    @commands.group(invoke_without_command=True)
+    @commands.is_owner()
+    async def breakers(self, ctx: Context):
+        """Shows the API circuit breaker states"""
+
+        lines: list[str] = [f'{"group":<10}{"state":<11}{"fails":<7}{"trips":<7}{"rejected":<10}retry']
+        for name, breaker in sorted(self.bot.functions.breakers.items()):
+            stats: dict[str, Any] = breaker.to_dict()
+            lines.append(
+                f'{name:<10}{stats["state"]:<11}{stats["failures"]:<7}{stats["trips"]:<7}'
+                f'{stats["rejected"]:<10}{stats["retry_after"]:.0f}s'
+            )
+        lines.append(f'\nrecovery mode: {self.bot.functions.disabled}')
+        lines.append(f'retries: {self.bot.functions.retries}, hedges: {self.bot.functions.hedges}')
+        joined: str = '\n'.join(lines)
+        await ctx.reply(f'```\n{joined}```')
+
+    @breakers.command(name='reset')
+    @commands.is_owner()
+    async def breakers_reset(self, ctx: Context, group: Optional[str] = None):
+        """Closes every circuit breaker, or only the given group"""
+
+        breakers = self.bot.functions.breakers
+        if group is None:
+            for breaker in breakers.values():
+                breaker.reset()
+            return await ctx.reply('reset all breakers')
+
+        if group not in breakers:
+            return await ctx.handle_error(404, f'Unknown endpoint group `{group}`')
+        breakers[group].reset()
+        await ctx.reply(f'reset the `{group}` breaker')
+
+    @commands.command()
+    @commands.is_owner()
+    async def ratelimits(self, ctx: Context):
+        """Shows the API rate limiter buckets"""
+
+        lines: list[str] = [
+            f'{"group":<10}{"tokens":<10}{"queued":<8}{"delayed":<9}{"429s":<6}{"avg wait":<10}{"max wait":<10}blocked'
+        ]
+        for name, stats in self.bot.functions.limiter.stats().items():
+            tokens: str = f'{stats["tokens"]:.1f}/{stats["burst"]}' if stats['rate'] else 'no cap'
+            lines.append(
+                f'{name:<10}{tokens:<10}{stats["queued"]:<8}{stats["delayed"]:<9}'
+                f'{stats["throttled"]:<6}{stats["avg_wait"]:<10.2f}{stats["max_wait"]:<10.2f}{stats["blocked_for"]:.1f}s'
+            )
+        joined: str = '\n'.join(lines)
+        await ctx.reply(f'```\n{joined}```')
+
+    @commands.command()
+    @commands.is_owner()
+    async def dispatch(self, ctx: Context):
+        """Shows the API connection slots handed out per priority"""
+
+        dispatcher = self.bot.functions.dispatcher
+        lines: list[str] = [
+            f'slots: {dispatcher.active}/{dispatcher.capacity} '
+            f'({dispatcher.reserved} reserved for mods, low capped at {dispatcher.low_limit})',
+            f'{"priority":<10}{"active":<8}{"queued":<8}{"admitted":<10}{"delayed":<9}{"avg wait":<10}max wait'
+        ]
+        for name, stats in dispatcher.to_dict().items():
+            lines.append(
+                f'{name:<10}{stats["active"]:<8}{stats["queued"]:<8}{stats["admitted"]:<10}{stats["delayed"]:<9}'
+                f'{stats["avg_wait"]:<10.2f}{stats["max_wait"]:.2f}'
+            )
+        joined: str = '\n'.join(lines)
+        await ctx.reply(f'```\n{joined}```')
+
+    @commands.command()
+    @commands.is_owner()
+    async def moderation(self, ctx: Context):
+        """Shows the message moderation pipeline stats"""
+
+        lines: list[str] = [
+            f'{key:<16}{value:.2f}' if isinstance(value, float) else f'{key:<16}{value}'
+            for key, value in self.bot.moderation.stats().items()
+        ]
+        joined: str = '\n'.join(lines)
+        await ctx.reply(f'```\n{joined}```')
+
+    @commands.command()
+    @commands.is_owner()
+    async def aiqueue(self, ctx: Context):
+        """Shows the AI job scheduler stats"""
+
+        cog = self.bot.get_cog('AI')
+        if cog is None:
+            return await ctx.reply('the AI cog is not loaded')
+
+        lines: list[str] = [
+            f'{key:<16}{value:.2f}' if isinstance(value, float) else f'{key:<16}{value}'
+            for key, value in cog.scheduler.stats().items()
+        ]
+        joined: str = '\n'.join(lines)
+        await ctx.reply(f'```\n{joined}```')
+
     @commands.command()
     @commands.is_owner()
     async def uploadcommands(self, ctx: Context):
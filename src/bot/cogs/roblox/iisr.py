@@ -6,6 +6,8 @@ from discord import app_commands
 
 import aiohttp
 import asyncio
+import contextlib
+import io
 import json as JSON
 
 from racbot import RACBot
@@ -13,25 +15,98 @@ from utils.context import Context
 from utils.enums import CommandSignatures, Endpoints, api_headers
 from utils.exceptions import HTTPException, GeneralException
 from utils import checks
+from utils.outbox import OutboxEntry, describe, receipt
+from utils.batch import BatchResult, parse_targets, run_batch
 from utils.flags import (
     IISRTempBanFlags,
     IISRPermBanFlags,
+    IISRBatchTempBanFlags,
+    IISRBatchPermBanFlags,
+    IISRBatchKickFlags,
 )
 
 
+batch_concurrency: int = 5
+batch_limit: int = 100
+
+
 class IISR(commands.Cog):
     """IISR game commands"""
 
     def __init__(self, bot: RACBot) -> None:
         self.bot: RACBot = bot
-        self.get_body = bot.functions.get_body
-        self.request = bot.functions.endpoint_request
+        self.api = bot.api
         self.variables = bot.variables
 
     @property
     def display_emoji(self) -> discord.PartialEmoji:
         return discord.PartialEmoji(name='\N{BLACK QUESTION MARK ORNAMENT}')
 
+    async def read_targets(self, ctx: Context, inline: Optional[str]) -> list[str]:
+        attached: Optional[str] = None
+        if ctx.message.attachments:
+            attachment: discord.Attachment = ctx.message.attachments[0]
+            if attachment.size > 64 * 1024:
+                raise HTTPException(413, 'Attached target list too large (max 64 KiB)')
+            attached = (await attachment.read()).decode('utf-8', errors='replace')
+
+        targets: list[str] = parse_targets(inline, attached, limit=batch_limit)
+        if not targets:
+            raise GeneralException('No targets given, use -targets or attach a text/CSV file')
+        return targets
+
+    async def batch(
+        self, 
+        ctx: Context, 
+        action: str, 
+        endpoint: Endpoints, 
+        method: str, 
+        targets: list[str], 
+        params: dict[str, str],
+        *,
+        queue: bool = False
+    ) -> None:
+        message: discord.Message = await ctx.reply(f'{action} 0/{len(targets)}...')
+        # target -> outbox entry id, for the calls held back until the API recovers
+        queued: dict[str, int] = {}
+
+        async def worker(target: str) -> None:
+            if not queue:
+                await self.api.call(endpoint, method, json={'username': target}, params=params)
+                return
+            entry_id: Optional[int] = await self.api.deliver(endpoint, method, json={'username': target}, params=params)
+            if entry_id is not None:
+                queued[target] = entry_id
+
+        async def progress(done: int, failed: int, total: int) -> None:
+            # a failed edit must not fail the target whose worker happened to report it
+            with contextlib.suppress(discord.HTTPException):
+                await message.edit(content=f'{action} {done}/{total}... ({failed} failed)')
+
+        results: list[BatchResult] = await run_batch(
+            targets, 
+            worker, 
+            concurrency=batch_concurrency, 
+            on_progress=progress
+        )
+        failures: list[BatchResult] = [result for result in results if not result.ok]
+        summary: str = f'{action} done: {len(results) - len(failures) - len(queued)}/{len(results)} succeeded'
+        if queued:
+            summary += f', {len(queued)} queued until the API recovers'
+        if not failures and not queued:
+            return await message.edit(content=summary)
+
+        report: str = '\n'.join(
+            [f'{target}: queued as #{entry_id}' for target, entry_id in queued.items()]
+            + [f'{result.target}: {result.error}' for result in failures]
+        )
+        if len(summary) + len(report) + 10 > 2000:
+            fp = io.BytesIO(report.encode())
+            await message.edit(content=summary)
+            await message.reply(file=discord.File(fp, filename='report.txt'))
+        else:
+            await message.edit(content=f'{summary}\n```\n{report}```')
+
     @commands.group(invoke_without_command=True)
     @commands.cooldown(1, 3, commands.BucketType.user)
     @commands.guild_only()
@@ -58,28 +133,8 @@ class IISR(commands.Cog):
         """
 
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_bans, 
-                        'get',
-                        headers=api_headers
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                if type(body) == dict:
-                    await ctx.reply(f'```js\n{body}```')
-                else:
-                    raise GeneralException('Response mimetype was not application/json')
+            body: dict[str, Any] = await self.api.json(Endpoints.iisr_bans, 'get')
+            await ctx.reply(f'```js\n{body}```')
 
     @iisr_ban.command(name='temp', usage=CommandSignatures.iisr_temp_ban.value)
     @checks.is_a_mod()
@@ -105,27 +160,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_temp_ban_create, 
-                        'post',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_temp_ban_create, 'post', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @iisr_ban.command(name='perm', aliases=['permanent'], usage=CommandSignatures.iisr_perm_ban.value)
     @checks.is_a_mod()
@@ -150,27 +186,51 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_perm_ban_create, 
-                        'post',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_perm_ban_create, 'post', json=json, params=params)
+            await ctx.reply(receipt(queued))
+
+    @iisr_ban.command(name='temp-batch', usage=CommandSignatures.iisr_temp_ban_batch.value)
+    @checks.is_a_mod()
+    async def iisr_temp_ban_batch(self, ctx: Context, *, flags: IISRBatchTempBanFlags):
+        """Ban many players temporarily in IISR
+
+        Args:
+            ctx (Context): _description_
+            flags (IISRBatchTempBanFlags): The flags to use, targets can also be an attached text/CSV file
+        """
+
+        if flags.reason and len(flags.reason) > 100:
+            raise HTTPException(414, 'Reason content too large (max 100)')
+
+        targets: list[str] = await self.read_targets(ctx, flags.targets)
+        params: dict[str, str] = {
+            'mod': ctx.author.name,
+            'duration': flags.duration,
+            'server_id': flags.serverid,
+            'reason': flags.reason or 'No reason provided'
+        }
+        await self.batch(ctx, 'Banning', Endpoints.iisr_temp_ban_create, 'post', targets, params, queue=True)
+
+    @iisr_ban.command(name='perm-batch', usage=CommandSignatures.iisr_perm_ban_batch.value)
+    @checks.is_a_mod()
+    async def iisr_perm_ban_batch(self, ctx: Context, *, flags: IISRBatchPermBanFlags):
+        """Ban many players permanently in IISR
+
+        Args:
+            ctx (Context): _description_
+            flags (IISRBatchPermBanFlags): The flags to use, targets can also be an attached text/CSV file
+        """
+
+        if flags.reason and len(flags.reason) > 100:
+            raise HTTPException(414, 'Reason content too large (max 100)')
+
+        targets: list[str] = await self.read_targets(ctx, flags.targets)
+        params: dict[str, str] = {
+            'mod': ctx.author.name,
+            'server_id': flags.serverid,
+            'reason': flags.reason or 'No reason provided'
+        }
+        await self.batch(ctx, 'Banning', Endpoints.iisr_perm_ban_create, 'post', targets, params, queue=True)
 
     @iisr_ban.command(name='temp-all', usage=CommandSignatures.iisr_temp_ban.value)
     @checks.is_a_mod()
@@ -196,27 +256,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_temp_ban_all_servers, 
-                        'post',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_temp_ban_all_servers, 'post', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @iisr_ban.command(name='perm-all', usage=CommandSignatures.iisr_perm_ban.value)
     @checks.is_a_mod()
@@ -241,27 +282,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_perm_ban_all_servers, 
-                        'post',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_perm_ban_all_servers, 'post', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @iisr_ban.command(name='remove', aliases=['delete'])
     @checks.is_a_mod()
@@ -283,27 +305,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_ban_remove, 
-                        'delete',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_ban_remove, 'delete', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @iisr_ban.command(name='remove-all', aliases=['delete-all'])
     @checks.is_a_mod()
@@ -323,27 +326,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_ban_remove_all_servers, 
-                        'delete',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_ban_remove_all_servers, 'delete', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @iisr.command(name='kick')
     @checks.is_a_mod()
@@ -370,27 +354,29 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_kick, 
-                        'get',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            await self.api.call(Endpoints.iisr_kick, 'get', json=json, params=params)
+            await ctx.reply('done')
+
+    @iisr.command(name='kick-batch', usage=CommandSignatures.iisr_kick_batch.value)
+    @checks.is_a_mod()
+    async def iisr_kick_batch(self, ctx: Context, *, flags: IISRBatchKickFlags):
+        """Kick many players
+
+        Args:
+            ctx (Context): _description_
+            flags (IISRBatchKickFlags): The flags to use, targets can also be an attached text/CSV file
+        """
+
+        reason: str = flags.reason or 'No reason provided'
+        if len(reason) > 100:
+            raise HTTPException(414, 'Reason content too large (max 100)')
+
+        targets: list[str] = await self.read_targets(ctx, flags.targets)
+        params: dict[str, str] = {
+            'mod': ctx.author.name,
+            'reason': reason
+        }
+        await self.batch(ctx, 'Kicking', Endpoints.iisr_kick, 'get', targets, params)
 
     @iisr.command(name='kick-all')
     @checks.is_a_mod()
@@ -413,26 +399,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_kick_all, 
-                        'get',
-                        headers=api_headers,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            await self.api.call(Endpoints.iisr_kick_all, 'get', params=params)
+            await ctx.reply('done')
 
     @iisr.group(name='server', invoke_without_command=True)
     async def iisr_server(self, ctx: Context):
@@ -459,27 +427,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_server_shutdown, 
-                        'delete',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_server_shutdown, 'delete', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @iisr_server.command(name='info')
     @checks.is_a_mod()
@@ -497,26 +446,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_server_info, 
-                        'get',
-                        headers=api_headers,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            await self.api.call(Endpoints.iisr_server_info, 'get', params=params)
+            await ctx.reply('done')
 
     @iisr_server.command(name='lock')
     @checks.is_a_mod()
@@ -541,27 +472,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_server_lock, 
-                        'patch',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_server_lock, 'patch', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @iisr_server.command(name='unlock')
     @checks.is_a_mod()
@@ -581,27 +493,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_server_unlock, 
-                        'patch',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.iisr_server_unlock, 'patch', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @iisr_server.command(name='announce')
     @checks.is_a_mod()
@@ -621,26 +514,8 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_server_announce, 
-                        'get',
-                        headers=api_headers,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply(f'ok, sent message of "{text}"')
+            await self.api.call(Endpoints.iisr_server_announce, 'get', params=params)
+            await ctx.reply(f'ok, sent message of "{text}"')
 
     @iisr_server.command(name='announce-all')
     @checks.is_a_mod()
@@ -658,26 +533,38 @@ class IISR(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.iisr_server_announce_all, 
-                        'get',
-                        headers=api_headers,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply(f'ok, sent message of "{text}"')
+            await self.api.call(Endpoints.iisr_server_announce_all, 'get', params=params)
+            await ctx.reply(f'ok, sent message of "{text}"')
+
+    @iisr.group(name='outbox', invoke_without_command=True)
+    @checks.is_a_mod()
+    async def iisr_outbox(self, ctx: Context):
+        """List IISR actions queued while the API was unreachable
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        entries: list[OutboxEntry] = await self.bot.outbox.pending('iisr')
+        if not entries:
+            return await ctx.reply('Nothing queued')
+
+        await ctx.reply(f'```{describe(entries)}\n\n{len(entries)} queued```')
+
+    @iisr_outbox.command(name='cancel')
+    @checks.is_a_mod()
+    async def iisr_outbox_cancel(self, ctx: Context, entry_id: int):
+        """Cancel a queued IISR action before it is replayed
+
+        Args:
+            ctx (Context): _description_
+            entry_id (int): The queued action to cancel
+        """
+
+        entries: list[OutboxEntry] = await self.bot.outbox.pending('iisr')
+        if entry_id not in [entry.id for entry in entries] or not await self.bot.outbox.cancel(entry_id):
+            raise GeneralException(f'No queued action with id #{entry_id}')
+        await ctx.reply(f'ok, cancelled #{entry_id}')
 
 
 async def setup(bot: RACBot):
@@ -13,6 +13,7 @@ from utils.context import Context
 from utils.enums import Endpoints, api_headers
 from utils.exceptions import HTTPException, GeneralException
 from utils import checks
+from utils.outbox import OutboxEntry, describe, receipt
 
 
 class RoGuessr(commands.Cog):
@@ -20,8 +21,7 @@ class RoGuessr(commands.Cog):
 
     def __init__(self, bot: RACBot):
         self.bot: RACBot = bot
-        self.get_body = bot.functions.get_body
-        self.request = bot.functions.endpoint_request
+        self.api = bot.api
         self.variables = bot.variables
 
     @property
@@ -62,27 +62,8 @@ class RoGuessr(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.roguessr_server_shutdown, 
-                        'delete',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            queued: Optional[int] = await self.api.deliver(Endpoints.roguessr_server_shutdown, 'delete', json=json, params=params)
+            await ctx.reply(receipt(queued))
 
     @roguessr_server.command(name='info')
     @checks.is_a_mod()
@@ -100,26 +81,8 @@ class RoGuessr(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.roguessr_server_info, 
-                        'get',
-                        headers=api_headers,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply('done')
+            await self.api.call(Endpoints.roguessr_server_info, 'get', params=params)
+            await ctx.reply('done')
 
     @roguessr_server.command(name='announce')
     @checks.is_a_mod()
@@ -139,26 +102,8 @@ class RoGuessr(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.roguessr_server_announce, 
-                        'get',
-                        headers=api_headers,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply(f'ok, sent message of "{text}"')
+            await self.api.call(Endpoints.roguessr_server_announce, 'get', params=params)
+            await ctx.reply(f'ok, sent message of "{text}"')
 
     @roguessr_server.command(name='announce-all')
     @checks.is_a_mod()
@@ -176,26 +121,8 @@ class RoGuessr(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.roguessr_server_announce_all, 
-                        'get',
-                        headers=api_headers,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply(f'ok, sent message of "{text}"')
+            await self.api.call(Endpoints.roguessr_server_announce_all, 'get', params=params)
+            await ctx.reply(f'ok, sent message of "{text}"')
 
     @roguessr.group(name='game')
     async def roguessr_game(self, ctx: Context):
@@ -213,32 +140,12 @@ class RoGuessr(commands.Cog):
         """
 
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.roguessr_game_maps, 
-                        'get',
-                        headers=api_headers,
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                if type(body) == dict:
-                    maps: list[str] = body['maps']
-                    total: int = body['total']
-                    joined = '\n'.join(maps)
-
-                    await ctx.reply(f'```{joined}\n\n{total} maps total```')
-                else:
-                    raise GeneralException('Response mimetype was not application/json')
+            body: dict[str, Any] = await self.api.json(Endpoints.roguessr_game_maps, 'get')
+            maps: list[str] = body['maps']
+            total: int = body['total']
+            joined = '\n'.join(maps)
+
+            await ctx.reply(f'```{joined}\n\n{total} maps total```')
                 
     @roguessr_game.command(name='change-map')
     @checks.is_a_mod()
@@ -260,28 +167,39 @@ class RoGuessr(commands.Cog):
         }
         
         async with ctx.typing():
-            try:
-                request = await asyncio.wait_for(
-                    self.request(
-                        Endpoints.roguessr_game_change_map, 
-                        'put',
-                        headers=api_headers,
-                        json=json,
-                        params=params
-                    ),
-                    timeout=30
-                )
-            except TimeoutError:
-                raise HTTPException(504, 'Gateway Timeout')
-            except Exception as e:
-                raise commands.CommandInvokeError(e)
-            else:
-                status, reason, body = request
-                if status not in self.variables['ok_status_codes']:
-                    raise HTTPException(status, reason or 'Unknown Error Detail', body)
-                
-                await ctx.reply(f'ok, changed the map to `{map_name}`')
+            await self.api.call(Endpoints.roguessr_game_change_map, 'put', json=json, params=params)
+            await ctx.reply(f'ok, changed the map to `{map_name}`')
+
+    @roguessr.group(name='outbox', invoke_without_command=True)
+    @checks.is_a_mod()
+    async def roguessr_outbox(self, ctx: Context):
+        """List RoGuessr actions queued while the API was unreachable
+
+        Args:
+            ctx (Context): _description_
+        """
+
+        entries: list[OutboxEntry] = await self.bot.outbox.pending('roguessr')
+        if not entries:
+            return await ctx.reply('Nothing queued')
+
+        await ctx.reply(f'```{describe(entries)}\n\n{len(entries)} queued```')
+
+    @roguessr_outbox.command(name='cancel')
+    @checks.is_a_mod()
+    async def roguessr_outbox_cancel(self, ctx: Context, entry_id: int):
+        """Cancel a queued RoGuessr action before it is replayed
+
+        Args:
+            ctx (Context): _description_
+            entry_id (int): The queued action to cancel
+        """
+
+        entries: list[OutboxEntry] = await self.bot.outbox.pending('roguessr')
+        if entry_id not in [entry.id for entry in entries] or not await self.bot.outbox.cancel(entry_id):
+            raise GeneralException(f'No queued action with id #{entry_id}')
+        await ctx.reply(f'ok, cancelled #{entry_id}')
+
 
-    
 async def setup(bot: RACBot):
     await bot.add_cog(RoGuessr(bot))
\ No newline at end of file
@@ -3,10 +3,9 @@ from contextlib import contextmanager
 import asyncio
 import click
 import logging
+import os
 from logging.handlers import RotatingFileHandler
 
-from racbot import RACBot
-
 
 class RemoveNoise(logging.Filter):
     def __init__(self) -> None:
@@ -47,17 +46,82 @@ def setup_logging():
 
 
 async def run_bot() -> None:
+    # imported here so --api-url is applied before the endpoints are built
+    from racbot import RACBot
+
     async with RACBot() as bot:
         await bot.start()
 
 
 @click.group(invoke_without_command=True, options_metavar='[options]')
+@click.option('--api-url', help='Use another API deployment, e.g. http://127.0.0.1:8080/')
 @click.pass_context
-def main(ctx: click.Context):
+def main(ctx: click.Context, api_url: str):
+    if api_url:
+        os.environ['RAC_API_URL'] = api_url if api_url.endswith('/') else api_url + '/'
     if ctx.invoked_subcommand is None:
         with setup_logging():
             asyncio.run(run_bot())
 
 
+@main.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8080, show_default=True)
+@click.option('--latency', default=0.05, show_default=True, help='Median response latency in seconds')
+@click.option('--sigma', default=0.5, show_default=True, help='Log-normal spread of the latency')
+@click.option('--error-rate', default=0.0, show_default=True, help='Fraction of 5xx responses')
+@click.option('--ratelimit-rate', default=0.0, show_default=True, help='Fraction of 429 responses')
+@click.option('--token-delay', default=0.02, show_default=True, help='Seconds between words of a streamed AI reply')
+@click.option('--seed', type=int, default=None, help='Seed for reproducible runs')
+def standin(
+    host: str, 
+    port: int, 
+    latency: float, 
+    sigma: float, 
+    error_rate: float, 
+    ratelimit_rate: float, 
+    token_delay: float, 
+    seed: int
+):
+    """Runs a local stand-in for the RAC API"""
+
+    from standin import StandInSettings, run
+    
+    settings = StandInSettings(
+        latency=latency,
+        sigma=sigma,
+        error_rate=error_rate,
+        ratelimit_rate=ratelimit_rate,
+        token_delay=token_delay,
+        seed=seed
+    )
+    logging.basicConfig(level=logging.INFO)
+    run(host, port, settings)
+
+
+@main.command()
+@click.option('--iterations', default=500, show_default=True)
+@click.option('--concurrency', default=16, show_default=True)
+@click.option('--api-latency', default=0.0, show_default=True, help='Median stand-in API latency in seconds')
+@click.option('--command', 'only', multiple=True, help='Only run the named scenario, e.g. "help"')
+@click.option('--output', default='bench_results.json', show_default=True)
+def bench(iterations: int, concurrency: int, api_latency: float, only: tuple[str, ...], output: str):
+    """Benchmarks prefix command throughput against the stand-in API"""
+
+    from bench import run_benchmarks, write_results
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('discord').setLevel(logging.WARNING)
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+    results = asyncio.run(run_benchmarks(
+        iterations=iterations,
+        concurrency=concurrency,
+        api_latency=api_latency,
+        only=list(only) or None
+    ))
+    write_results(results, output)
+    click.echo(f'wrote {output}')
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Union, Any
+from typing import Union, Any, Optional
 
 import discord
 from discord.ext import commands
@@ -8,11 +8,22 @@ import logging
 import aiohttp
 import asyncio
 import datetime
+import os
 import sys
 
 from utils.config import Config
 from utils.context import Context
+from utils.client import APIClient
+from utils.dispatch import command_priority, current_priority
 from utils.functions import Functions
+from utils.http import ConnectorSettings, PoolStats, create_session
+from utils.conversations import ConversationStore
+from utils.imagestore import ImageStore
+from utils.messagebuffer import MessageBuffer
+from utils.moderation import ModerationPipeline, PendingMessage
+from utils.reencode import ImageEncoder
+from utils.outbox import Outbox
+from utils.promptcache import PromptCache
 from utils.exceptions import HTTPException, GeneralException
 
 
@@ -71,6 +82,39 @@ class RACBot(commands.Bot): # change later to AutoShardedBot
         )
         self.logger: logging.Logger = logging.getLogger(__name__)
         self.config = Config
+        self.connector_settings: ConnectorSettings = ConnectorSettings(
+            limit=100,
+            limit_per_host=30,
+            keepalive_timeout=60.0,
+            ttl_dns_cache=300
+        )
+        self.pool_stats: PoolStats = PoolStats()
+        self.outbox: Outbox = Outbox(os.environ.get('RAC_OUTBOX_PATH', 'outbox.db'))
+        self.prompt_cache: PromptCache = PromptCache(
+            os.environ.get('RAC_PROMPT_CACHE_OPTIN_PATH', 'prompt_cache_optin.json'),
+            enabled=os.environ.get('RAC_PROMPT_CACHE', '0') == '1'
+        )
+        # unset leaves images exactly as the API returns them
+        image_format: str = os.environ.get('RAC_IMAGE_FORMAT', '')
+        encoder: Optional[ImageEncoder] = None
+        if image_format:
+            encoder = ImageEncoder(
+                image_format,
+                quality=int(os.environ.get('RAC_IMAGE_QUALITY', '80')),
+                max_side=int(os.environ.get('RAC_IMAGE_MAX_SIDE', '1024'))
+            )
+            if not encoder.available:
+                self.logger.warning('RAC_IMAGE_FORMAT is set but Pillow is not installed, images are not re-encoded')
+        self.images: ImageStore = ImageStore(os.environ.get('RAC_IMAGE_CACHE_PATH', 'image_cache'), encoder=encoder)
+        self.conversations: ConversationStore = ConversationStore(
+            os.environ.get('RAC_CONVERSATIONS_PATH', 'conversations.db')
+        )
+        self.message_buffer: MessageBuffer = MessageBuffer()
+        # only guilds that set a report channel of their own have their messages checked
+        self.moderation: ModerationPipeline = ModerationPipeline(
+            os.environ.get('RAC_MODERATION_CHANNELS_PATH', 'moderation_channels.json')
+        )
+        self.before_invoke(self.prioritise)
 
     @property
     def owner(self) -> discord.User:
@@ -100,6 +144,9 @@ class RACBot(commands.Bot): # change later to AutoShardedBot
     async def on_ready(self):
         if not hasattr(self, 'uptime'):
             self.uptime = discord.utils.utcnow()
+        else:
+            # a new session, so anything sent while we were away was never seen
+            self.message_buffer.invalidate()
 
         self.logger.info('Ready: %s (ID: %s)', self.user, self.user.id)
 
@@ -107,10 +154,50 @@ class RACBot(commands.Bot): # change later to AutoShardedBot
         return await super().get_context(origin, cls=cls)
     
     async def on_message(self, message: discord.Message) -> None:
+        # history includes bot messages, so the buffer does too
+        self.message_buffer.add(message)
         if message.author.bot:
             return
+        self.moderation.submit(message)
         await self.process_commands(message)
 
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        if 'content' in payload.data:
+            self.message_buffer.edit(payload.channel_id, payload.message_id, payload.data['content'])
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        self.message_buffer.delete(payload.channel_id, (payload.message_id,))
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        self.message_buffer.delete(payload.channel_id, payload.message_ids)
+
+    async def report_flagged(self, pending: PendingMessage, result: dict[str, Any]) -> None:
+        # always the message's own guild, never anywhere else
+        channel_id: Optional[int] = self.moderation.report_channel(pending.guild_id)
+        channel = self.get_channel(channel_id) if channel_id else None
+        if not isinstance(channel, discord.abc.GuildChannel) or channel.guild.id != pending.guild_id:
+            self.logger.warning('Moderation channel %s not found for guild %s', channel_id, pending.guild_id)
+            return
+
+        categories: dict[str, Any] = result.get('categories') or {}
+        embed = discord.Embed(title='Flagged Message', color=discord.Colour.red())
+        embed.description = pending.content[:1024]
+        embed.add_field(name='Author', value=f'{pending.author} (`{pending.author_id}`)')
+        embed.add_field(name='Channel', value=f'<#{pending.channel_id}> [jump]({pending.jump_url})')
+        embed.add_field(name='Score', value=f'{float(result.get("score") or 0):.2f}')
+        if categories:
+            embed.add_field(
+                name='Categories',
+                value=', '.join(f'{name} {float(score):.2f}' for name, score in categories.items()),
+                inline=False
+            )
+        embed.set_footer(text=f'Guild ID: {pending.guild_id}')
+        await channel.send(embed=embed)
+
+    async def prioritise(self, ctx: Context) -> None:
+        # runs in the invoking task, so the API calls the command makes see it
+        current_priority.set(command_priority(ctx.command))
+
     async def setup_hook(self) -> None:
         timeout: aiohttp.ClientTimeout = aiohttp.ClientTimeout(
             total=30,
@@ -118,8 +205,13 @@ class RACBot(commands.Bot): # change later to AutoShardedBot
             sock_connect=15,
             sock_read=20
         )
-        self.session: aiohttp.ClientSession = aiohttp.ClientSession(timeout=timeout)
-        self.functions: Functions = Functions(self, False)
+        self.session: aiohttp.ClientSession = create_session(
+            self.connector_settings, 
+            self.pool_stats, 
+            timeout=timeout
+        )
+        self.functions: Functions = Functions(self)
+        self.api: APIClient = APIClient(self)
         self.variables: dict[str, Any] = {
             'ok_status_codes': [
                 200,
@@ -127,6 +219,13 @@ class RACBot(commands.Bot): # change later to AutoShardedBot
                 204
             ]
         }
+        await self.outbox.open()
+        await self.prompt_cache.load()
+        await self.images.open()
+        await self.conversations.open()
+        await self.moderation.load()
+        self.outbox.start(self.functions)
+        self.moderation.start(self.api, self.report_flagged)
         
         for extension in extensions:
             try:
@@ -138,6 +237,10 @@ class RACBot(commands.Bot): # change later to AutoShardedBot
         await super().start(self.config.token())
 
     async def close(self) -> None:
+        self.outbox.close()
+        self.conversations.close()
+        self.images.close()
+        self.moderation.close()
         await self.session.close()
         await super().close()
 
@@ -0,0 +1,285 @@
+from typing import Any, Awaitable, Callable, Optional
+
+from aiohttp import web
+
+import asyncio
+import json as JSON
+import logging
+import math
+import os
+import random
+import struct
+import time
+import zlib
+
+from utils.enums import Endpoints, api_url
+
+
+log: logging.Logger = logging.getLogger(__name__)
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+class StandInSettings:
+    def __init__(
+        self,
+        *,
+        latency: float = 0.05,
+        sigma: float = 0.5,
+        error_rate: float = 0.0,
+        ratelimit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        token_delay: float = 0.02,
+        reply_words: tuple[int, int] = (20, 120),
+        seed: Optional[int] = None,
+        overrides: Optional[dict[str, dict[str, float]]] = None
+    ) -> None:
+        # latency is the median of a log-normal distribution, sigma its spread
+        self.latency: float = latency
+        self.sigma: float = sigma
+        self.error_rate: float = error_rate
+        self.ratelimit_rate: float = ratelimit_rate
+        self.retry_after: float = retry_after
+        # streamed replies send one word every token_delay seconds
+        self.token_delay: float = token_delay
+        self.reply_words: tuple[int, int] = reply_words
+        self.seed: Optional[int] = seed
+        # per endpoint group or endpoint name, e.g. {'ai': {'latency': 2.0}}
+        self.overrides: dict[str, dict[str, float]] = overrides or {}
+
+    def get(self, endpoint: Endpoints, name: str) -> float:
+        for key in (endpoint.name, endpoint.group):
+            if name in self.overrides.get(key, {}):
+                return self.overrides[key][name]
+        return getattr(self, name)
+
+
+def make_png(width: int, height: int, *, rng: random.Random) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    # half noise, half flat so the compressed size is close to a real render
+    half: int = (width * 3) // 2
+    rows: list[bytes] = [
+        b'\x00' + rng.randbytes(half) + bytes(width * 3 - half) for _ in range(height)
+    ]
+
+    header: bytes = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', header)
+        + chunk(b'IDAT', zlib.compress(b''.join(rows), 6))
+        + chunk(b'IEND', b'')
+    )
+
+
+class StandIn:
+    def __init__(self, settings: Optional[StandInSettings] = None) -> None:
+        self.settings: StandInSettings = settings or StandInSettings()
+        self.rng: random.Random = random.Random(self.settings.seed)
+        self.started: float = time.time()
+        self.hits: dict[str, int] = {}
+        self.bans: list[dict[str, str]] = [
+            {'username': f'player{index}', 'reason': 'exploiting', 'mod': 'kaog'} for index in range(25)
+        ]
+        self.maps: list[str] = [
+            'Paris', 'Tokyo', 'New York', 'London', 'Sydney', 'Cairo', 'Rio de Janeiro', 'Moscow'
+        ]
+        self._images: dict[tuple[int, int], bytes] = {}
+        self.conversations: dict[str, list[dict[str, str]]] = {}
+
+        self.handlers: dict[Endpoints, Handler] = {
+            Endpoints.ai_gemini_create: self.gemini,
+            Endpoints.ai_cloudflare_text_create: self.cloudflare_text,
+            Endpoints.ai_cloudflare_image_create: self.image,
+            Endpoints.ai_moderation_text: self.moderation,
+            Endpoints.ai_cai_create: self.cai_create,
+            Endpoints.ai_cai_history: self.cai_history,
+            Endpoints.fun1_wordcloud: self.wordcloud,
+            Endpoints.iisr_bans: self.iisr_bans,
+            Endpoints.iisr_server_info: self.server_info,
+            Endpoints.roguessr_server_info: self.server_info,
+            Endpoints.roguessr_game_maps: self.game_maps,
+            Endpoints.utility_ping: self.ping,
+            Endpoints.utility_usage: self.usage,
+            Endpoints.utility_uptime: self.uptime,
+            Endpoints.utility_tasks: self.tasks,
+        }
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        for endpoint in Endpoints:
+            path: str = '/' + endpoint.value[len(api_url):]
+            handler: Handler = self.handlers.get(endpoint, self.success)
+            app.router.add_route('*', path, self.wrap(endpoint, handler))
+        app.router.add_get('/_standin/stats', self.stats)
+        return app
+
+    def wrap(self, endpoint: Endpoints, handler: Handler) -> Handler:
+        async def wrapped(request: web.Request) -> web.StreamResponse:
+            self.hits[endpoint.name] = self.hits.get(endpoint.name, 0) + 1
+
+            median: float = self.settings.get(endpoint, 'latency')
+            if median > 0:
+                sigma: float = self.settings.get(endpoint, 'sigma')
+                await asyncio.sleep(self.rng.lognormvariate(math.log(median), sigma))
+
+            if self.rng.random() < self.settings.get(endpoint, 'ratelimit_rate'):
+                retry_after: float = self.settings.get(endpoint, 'retry_after')
+                return web.json_response(
+                    {'detail': 'Too Many Requests'},
+                    status=429,
+                    headers={
+                        'Retry-After': f'{retry_after:g}',
+                        'X-RateLimit-Limit': '60',
+                        'X-RateLimit-Remaining': '0',
+                        'X-RateLimit-Reset-After': f'{retry_after:g}',
+                    }
+                )
+            if self.rng.random() < self.settings.get(endpoint, 'error_rate'):
+                status: int = self.rng.choice((500, 502, 503))
+                return web.json_response({'detail': 'Injected failure'}, status=status)
+
+            return await handler(request)
+        return wrapped
+
+    async def payload(self, request: web.Request) -> dict[str, Any]:
+        if not request.can_read_body:
+            return {}
+        try:
+            body: Any = await request.json()
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def reply_text(self, prompt: str) -> str:
+        words: list[str] = ['sure', 'here', 'is', 'an', 'answer', 'about', 'that', 'topic', 'which', 'covers']
+        length: int = self.rng.randint(*self.settings.reply_words)
+        return f'You asked: {prompt[:100]}\n' + ' '.join(self.rng.choice(words) for _ in range(length))
+
+    async def success(self, request: web.Request) -> web.Response:
+        return web.json_response({'success': True})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'hits': self.hits, 'uptime': time.time() - self.started})
+
+    async def event_stream(self, request: web.Request, text: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        for index, word in enumerate(text.split(' ')):
+            if self.settings.token_delay > 0:
+                await asyncio.sleep(self.settings.token_delay)
+            delta: str = word if index == 0 else ' ' + word
+            await response.write(b'data: ' + JSON.dumps({'response': delta}).encode() + b'\n\n')
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def gemini(self, request: web.Request) -> web.StreamResponse:
+        body: dict[str, Any] = await self.payload(request)
+        text: str = self.reply_text(str(body.get('prompt', '')))
+        if body.get('stream'):
+            return await self.event_stream(request, text)
+        return web.json_response({'response': text})
+
+    async def cloudflare_text(self, request: web.Request) -> web.StreamResponse:
+        body: dict[str, Any] = await self.payload(request)
+        text: str = self.reply_text(str(body.get('prompt', '')))
+        if body.get('stream'):
+            return await self.event_stream(request, text)
+        return web.json_response({'result': {'response': text}})
+
+    async def image(self, request: web.Request) -> web.Response:
+        body: dict[str, Any] = await self.payload(request)
+        size: tuple[int, int] = (int(body.get('width', 512)), int(body.get('height', 512)))
+        if size not in self._images:
+            self._images[size] = make_png(*size, rng=self.rng)
+        return web.Response(body=self._images[size], content_type='image/png')
+
+    async def wordcloud(self, request: web.Request) -> web.Response:
+        body: dict[str, Any] = await self.payload(request)
+        # either the raw text or the word counts the bot works out itself
+        frequencies: Any = body.get('frequencies')
+        if frequencies is not None:
+            valid: bool = isinstance(frequencies, dict) and all(
+                isinstance(count, int) and count > 0 for count in frequencies.values()
+            )
+        else:
+            valid = isinstance(body.get('text'), str)
+        if not valid:
+            return web.json_response({'error': 'Expected text or a word to count map'}, status=422)
+        return await self.image(request)
+
+    async def moderation(self, request: web.Request) -> web.Response:
+        body: dict[str, Any] = await self.payload(request)
+        texts: list[str] = body.get('input') or [body.get('text', '')]
+        results: list[dict[str, Any]] = []
+        for text in texts:
+            score: float = self.rng.random() * 0.2
+            if any(word in str(text).lower() for word in ('kill', 'hate', 'slur')):
+                score = 0.9
+            results.append({'flagged': score > 0.5, 'score': score, 'categories': {'harassment': score}})
+        return web.json_response({'results': results})
+
+    async def cai_create(self, request: web.Request) -> web.Response:
+        body: dict[str, Any] = await self.payload(request)
+        prompt: str = str(body.get('prompt', ''))
+        conversation_id: Optional[str] = body.get('conversation_id')
+        if conversation_id and conversation_id not in self.conversations:
+            return web.json_response({'error': 'Unknown conversation'}, status=404)
+        if not conversation_id:
+            conversation_id = f'{self.rng.getrandbits(64):x}'
+            self.conversations[conversation_id] = list(body.get('history') or [])
+
+        response: str = self.reply_text(prompt)
+        self.conversations[conversation_id] += [
+            {'role': 'user', 'content': prompt},
+            {'role': 'assistant', 'content': response},
+        ]
+        return web.json_response({'response': response, 'conversation_id': conversation_id})
+
+    async def cai_history(self, request: web.Request) -> web.Response:
+        conversation_id: str = request.query.get('conversation_id', '')
+        return web.json_response({'history': self.conversations.get(conversation_id, [])})
+
+    async def iisr_bans(self, request: web.Request) -> web.Response:
+        return web.json_response({'bans': self.bans, 'total': len(self.bans)})
+
+    async def server_info(self, request: web.Request) -> web.Response:
+        server_id: str = request.query.get('server_id', '0')
+        players: list[str] = [f'player{self.rng.randint(0, 9999)}' for _ in range(self.rng.randint(0, 30))]
+        return web.json_response({'id': server_id, 'players': players, 'locked': False, 'map': self.maps[0]})
+
+    async def game_maps(self, request: web.Request) -> web.Response:
+        return web.json_response({'maps': self.maps, 'total': len(self.maps)})
+
+    async def ping(self, request: web.Request) -> web.Response:
+        return web.json_response({'time': time.time()})
+
+    async def usage(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'main': {'cpu': f'{self.rng.uniform(1, 40):.1f}%', 'rssMem': '142.3 MB', 'vmsMem': '512.8 MB'},
+            'storage': {'used': '12.4 GB', 'total': '64 GB'},
+        })
+
+    async def uptime(self, request: web.Request) -> web.Response:
+        return web.json_response({'uptime': time.time() - self.started})
+
+    async def tasks(self, request: web.Request) -> web.Response:
+        return web.json_response({'tasks': []})
+
+
+async def serve(host: str, port: int, settings: Optional[StandInSettings] = None) -> web.AppRunner:
+    runner = web.AppRunner(StandIn(settings).app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info('RAC API stand-in listening on http://%s:%s/', host, port)
+    return runner
+
+
+def run(host: str = '127.0.0.1', port: int = 8080, settings: Optional[StandInSettings] = None) -> None:
+    web.run_app(StandIn(settings).app(), host=host, port=port)
+
+
+if __name__ == '__main__':
+    run(port=int(os.environ.get('RAC_STANDIN_PORT', 8080)))
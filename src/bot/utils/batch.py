@@ -0,0 +1,103 @@
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import asyncio
+import csv
+import io
+import time
+
+from discord.ext import commands
+
+from .exceptions import HTTPException, GeneralException
+
+
+header_names: frozenset[str] = frozenset({'username', 'user', 'target', 'player', 'name'})
+
+
+class BatchResult:
+    __slots__ = ('target', 'ok', 'error')
+
+    def __init__(self, target: str, ok: bool, error: Optional[str] = None) -> None:
+        self.target: str = target
+        self.ok: bool = ok
+        self.error: Optional[str] = error
+
+
+def parse_targets(*sources: Optional[str], limit: int = 100) -> list[str]:
+    """Reads targets from inline text or an attached file.
+
+    A single line is split on commas and whitespace, while several lines are
+    read as CSV with the username in the first column.
+    """
+
+    targets: list[str] = []
+    seen: set[str] = set()
+    for source in sources:
+        if not source:
+            continue
+
+        lines: list[str] = [line for line in source.splitlines() if line.strip()]
+        if len(lines) > 1:
+            cells: list[str] = [row[0] for row in csv.reader(lines) if row]
+        else:
+            cells = source.split(',')
+
+        for cell in cells:
+            for target in cell.split():
+                if target.lower() in header_names or target in seen:
+                    continue
+                seen.add(target)
+                targets.append(target)
+
+    if len(targets) > limit:
+        raise HTTPException(413, f'Too many targets (max {limit})')
+    return targets
+
+
+def describe_error(error: BaseException) -> str:
+    if isinstance(error, HTTPException):
+        return f'{error.status} {error.detail}'
+    if isinstance(error, GeneralException):
+        return str(error.error)
+    if isinstance(error, commands.CommandInvokeError):
+        error = error.original
+    return f'{error.__class__.__name__}: {error}'
+
+
+async def run_batch(
+    targets: Iterable[str],
+    worker: Callable[[str], Awaitable[Any]],
+    *,
+    concurrency: int = 5,
+    on_progress: Optional[Callable[[int, int, int], Awaitable[Any]]] = None,
+    progress_interval: float = 1.5
+) -> list[BatchResult]:
+    """Runs ``worker`` for every target with at most ``concurrency`` at once.
+
+    ``on_progress(done, failed, total)`` is awaited at most once every
+    ``progress_interval`` seconds while the batch is running.
+    """
+
+    items: list[str] = list(targets)
+    results: list[Optional[BatchResult]] = [None] * len(items)
+    semaphore = asyncio.Semaphore(concurrency)
+    counts: list[int] = [0, 0]
+    last_progress: list[float] = [time.monotonic()]
+
+    async def run_one(index: int, target: str) -> None:
+        async with semaphore:
+            try:
+                await worker(target)
+            except Exception as e:
+                results[index] = BatchResult(target, False, describe_error(e))
+                counts[1] += 1
+            else:
+                results[index] = BatchResult(target, True)
+            counts[0] += 1
+
+        now: float = time.monotonic()
+        if on_progress and now - last_progress[0] >= progress_interval:
+            last_progress[0] = now
+            await on_progress(counts[0], counts[1], len(items))
+
+    await asyncio.gather(*(run_one(index, target) for index, target in enumerate(items)))
+    return [result for result in results if result is not None]
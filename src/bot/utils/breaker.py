@@ -0,0 +1,90 @@
+from typing import Any, Optional
+
+import time
+
+
+class CircuitBreaker:
+    closed: str = 'closed'
+    open: str = 'open'
+    half_open: str = 'half-open'
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_probes: int = 1
+    ) -> None:
+        self.name: str = name
+        self.failure_threshold: int = failure_threshold
+        self.recovery_timeout: float = recovery_timeout
+        self.half_open_probes: int = half_open_probes
+
+        self.state: str = self.closed
+        self.failures: int = 0
+        self.total_failures: int = 0
+        self.rejected: int = 0
+        self.trips: int = 0
+        self.opened_at: Optional[float] = None
+        self._probes: int = 0
+
+    @property
+    def retry_after(self) -> float:
+        if self.state != self.open or self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.recovery_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == self.open:
+            if self.retry_after > 0:
+                self.rejected += 1
+                return False
+            self.state = self.half_open
+            self._probes = 0
+
+        if self.state == self.half_open:
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                return False
+            self._probes += 1
+
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probes = 0
+        self.opened_at = None
+        self.state = self.closed
+
+    def release_probe(self) -> None:
+        # the call ended without an outcome, e.g. it was abandoned or cancelled
+        # while queued, so its half-open slot goes to the next caller
+        if self.state == self.half_open and self._probes > 0:
+            self._probes -= 1
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.total_failures += 1
+        if self.state == self.half_open or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self) -> None:
+        if self.state != self.open:
+            self.trips += 1
+        self.state = self.open
+        self.opened_at = time.monotonic()
+        self._probes = 0
+
+    def reset(self) -> None:
+        self.record_success()
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'total_failures': self.total_failures,
+            'trips': self.trips,
+            'rejected': self.rejected,
+            'retry_after': self.retry_after,
+        }
@@ -0,0 +1,110 @@
+from typing import Any, Hashable, Optional
+
+from collections import OrderedDict
+import json as JSON
+import time
+
+
+def estimate_size(value: Any) -> int:
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode())
+    try:
+        return len(JSON.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(repr(value))
+
+
+class CacheEntry:
+    __slots__ = ('value', 'expires', 'size', 'tag')
+
+    def __init__(self, value: Any, expires: float, size: int, tag: Optional[Hashable]) -> None:
+        self.value: Any = value
+        self.expires: float = expires
+        self.size: int = size
+        self.tag: Optional[Hashable] = tag
+
+
+class TTLCache:
+    def __init__(self, *, max_entries: int = 512, max_bytes: int = 8 * 1024 * 1024) -> None:
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not None
+
+    def peek(self, key: Hashable) -> Optional[CacheEntry]:
+        entry: Optional[CacheEntry] = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry: Optional[CacheEntry] = self.peek(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def set(self, key: Hashable, value: Any, ttl: float, *, tag: Optional[Hashable] = None) -> bool:
+        size: int = estimate_size(value)
+        if size > self.max_bytes or ttl <= 0:
+            return False
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = CacheEntry(value, time.monotonic() + ttl, size, tag)
+        self.size += size
+        while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+        return True
+
+    def invalidate(self, key: Hashable) -> bool:
+        if key in self._entries:
+            self._remove(key)
+            return True
+        return False
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        keys: list[Hashable] = [key for key, entry in self._entries.items() if entry.tag == tag]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict[str, Any]:
+        total: int = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total) if total else 0.0,
+            'evictions': self.evictions,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        entry: CacheEntry = self._entries.pop(key)
+        self.size -= entry.size
@@ -18,4 +18,6 @@ mod_list: list[str] = [
 def is_a_mod():
     async def predicate(ctx: Context) -> bool:
         return ctx.author.name in mod_list
+    # lets the API dispatcher put mod commands ahead of everything else
+    predicate.mod_only = True
     return check(predicate)
\ No newline at end of file
@@ -0,0 +1,189 @@
+from typing import Any, Optional, Union
+
+from discord.ext import commands
+
+import aiohttp
+import asyncio
+import io
+
+from .enums import Endpoints, api_headers
+from .exceptions import HTTPException, GeneralException
+from .outbox import Outbox, transient_statuses
+from .streaming import EventStream
+
+
+class Deadline:
+    def __init__(self, total: float, *, connect: float = 5.0, read: Optional[float] = None) -> None:
+        self.total: float = total
+        self.connect: float = min(connect, total)
+        self.read: Optional[float] = read
+
+    def client_timeout(self) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            total=self.total,
+            connect=self.connect,
+            sock_connect=self.connect,
+            sock_read=self.read
+        )
+
+
+default_deadline: Deadline = Deadline(10)
+
+# whole-call budgets, retries and hedges included
+deadlines: dict[Endpoints, Deadline] = {
+    Endpoints.ai_gemini_create: Deadline(30, read=25),
+    Endpoints.ai_cloudflare_text_create: Deadline(30, read=25),
+    Endpoints.ai_cloudflare_image_create: Deadline(60, read=50),
+    Endpoints.ai_moderation_text: Deadline(10),
+    Endpoints.ai_cai_create: Deadline(30, read=25),
+    Endpoints.ai_cai_history: Deadline(10),
+    Endpoints.bot_commands_upload_commands: Deadline(30),
+    Endpoints.fun1_wordcloud: Deadline(30, read=25),
+    Endpoints.iisr_bans: Deadline(10),
+    Endpoints.iisr_server_info: Deadline(5, connect=2),
+    Endpoints.roguessr_server_info: Deadline(5, connect=2),
+    Endpoints.roguessr_game_maps: Deadline(5, connect=2),
+    Endpoints.utility_ping: Deadline(5, connect=2),
+    Endpoints.utility_uptime: Deadline(5, connect=2),
+    Endpoints.utility_usage: Deadline(10),
+    Endpoints.utility_tasks: Deadline(10),
+}
+
+
+class APIClient:
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.functions = bot.functions
+
+    def deadline(self, endpoint: Endpoints) -> Deadline:
+        return deadlines.get(endpoint, default_deadline)
+
+    def check_status(self, status: int, reason: Optional[str], body: Any) -> None:
+        if status not in self.bot.variables['ok_status_codes']:
+            raise HTTPException(status, reason or 'Unknown Error Detail', body)
+
+    async def call(
+        self,
+        endpoint: Endpoints,
+        method: str = 'get',
+        /,
+        *,
+        json: dict[str, Any] = {},
+        params: dict[str, Any] = {},
+        headers: dict[str, Any] = api_headers,
+        image: bool = False
+    ) -> Union[str, Any]:
+        budget: Deadline = self.deadline(endpoint)
+        try:
+            # cancelling on expiry unwinds the request context, which gives the
+            # connection back to the pool instead of leaving it to finish; a
+            # shared GET is only cancelled once its last caller has given up
+            async with asyncio.timeout(budget.total):
+                if image:
+                    status, reason, body = await self.functions.image_request(
+                        endpoint,
+                        method,
+                        headers=headers,
+                        json=json,
+                        params=params,
+                        stream=True,
+                        timeout=budget.client_timeout()
+                    )
+                else:
+                    status, reason, body = await self.functions.endpoint_request(
+                        endpoint,
+                        method,
+                        headers=headers,
+                        json=json,
+                        params=params,
+                        timeout=budget.client_timeout()
+                    )
+        except TimeoutError:
+            raise HTTPException(504, 'Gateway Timeout')
+        except aiohttp.ClientError as e:
+            raise commands.CommandInvokeError(e)
+
+        self.check_status(status, reason, body)
+        return body
+
+    async def stream(
+        self,
+        endpoint: Endpoints,
+        method: str = 'post',
+        /,
+        *,
+        json: dict[str, Any] = {},
+        params: dict[str, Any] = {},
+        headers: dict[str, Any] = api_headers
+    ) -> Union[EventStream, dict[str, Any]]:
+        """Opens a streamed response, or returns the JSON body if the API did not stream.
+
+        The deadline only covers waiting for the response to start, after
+        that the read timeout applies to the gap between chunks.
+        """
+
+        budget: Deadline = self.deadline(endpoint)
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=budget.connect,
+            sock_connect=budget.connect,
+            sock_read=budget.read
+        )
+        try:
+            async with asyncio.timeout(budget.total):
+                status, reason, body = await self.functions.stream_request(
+                    endpoint, method, headers=headers, json=json, params=params, timeout=timeout
+                )
+        except TimeoutError:
+            raise HTTPException(504, 'Gateway Timeout')
+        except aiohttp.ClientError as e:
+            raise commands.CommandInvokeError(e)
+
+        self.check_status(status, reason, body)
+        if not isinstance(body, (EventStream, dict)):
+            raise GeneralException('Response mimetype was not application/json')
+        return body
+
+    async def deliver(
+        self,
+        endpoint: Endpoints,
+        method: str,
+        /,
+        *,
+        json: dict[str, Any] = {},
+        params: dict[str, Any] = {}
+    ) -> Optional[int]:
+        """Sends a mutating call, or queues it in the outbox if the API is unreachable.
+
+        Returns the outbox entry id when the call was queued.
+        """
+
+        outbox: Outbox = self.bot.outbox
+        key: str = outbox.new_key()
+        # anything already queued for the group goes first, so calls stay in order
+        if not await outbox.has_pending(endpoint.group):
+            headers: dict[str, Any] = {**api_headers, 'Idempotency-Key': key}
+            try:
+                await self.call(endpoint, method, json=json, params=params, headers=headers)
+                return None
+            except HTTPException as e:
+                if e.status not in transient_statuses:
+                    raise
+            except commands.CommandInvokeError:
+                pass
+
+        entry_id: int = await outbox.add(key, endpoint, method, json=json, params=params)
+        outbox.wakeup()
+        return entry_id
+
+    async def json(self, endpoint: Endpoints, method: str = 'get', /, **kwargs: Any) -> dict[str, Any]:
+        body: Union[str, Any] = await self.call(endpoint, method, **kwargs)
+        if not isinstance(body, dict):
+            raise GeneralException('Response mimetype was not application/json')
+        return body
+
+    async def image(self, endpoint: Endpoints, method: str = 'get', /, **kwargs: Any) -> io.IOBase:
+        body: Union[str, Any] = await self.call(endpoint, method, image=True, **kwargs)
+        if not isinstance(body, io.IOBase):
+            raise GeneralException('Response mimetype was not image/png')
+        return body
@@ -0,0 +1,79 @@
+from typing import Any, Union
+
+import asyncio
+import json as JSON
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+backend: str = 'orjson' if orjson is not None else 'json'
+
+# decoding bigger bodies than this moves off the event loop
+offload_size: int = 512 * 1024
+
+
+class CodecStats:
+    def __init__(self) -> None:
+        self.counters: dict[str, list[float]] = {}
+
+    def add(self, kind: str, size: int, seconds: float) -> None:
+        counter: list[float] = self.counters.setdefault(kind, [0, 0, 0.0, 0.0])
+        counter[0] += 1
+        counter[1] += size
+        counter[2] += seconds
+        counter[3] = max(counter[3], seconds)
+
+    def to_dict(self) -> dict[str, dict[str, float]]:
+        return {
+            kind: {
+                'count': count,
+                'bytes': size,
+                'total_ms': seconds * 1000,
+                'avg_ms': (seconds / count * 1000) if count else 0.0,
+                'max_ms': longest * 1000,
+            }
+            for kind, (count, size, seconds, longest) in self.counters.items()
+        }
+
+
+stats: CodecStats = CodecStats()
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return JSON.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return JSON.dumps(obj, default=str, separators=(',', ':')).encode()
+
+
+async def decode_json(data: bytes) -> Any:
+    started: float = time.perf_counter()
+    if len(data) > offload_size:
+        body: Any = await asyncio.to_thread(loads, data)
+    else:
+        body = loads(data)
+    stats.add('json_decode', len(data), time.perf_counter() - started)
+    return body
+
+
+def decode_text(data: bytes, encoding: str = 'utf-8') -> str:
+    started: float = time.perf_counter()
+    text: str = data.decode(encoding, errors='replace')
+    stats.add('text_decode', len(data), time.perf_counter() - started)
+    return text
+
+
+def encode_json(obj: Any) -> bytes:
+    started: float = time.perf_counter()
+    data: bytes = dumps(obj)
+    stats.add('json_encode', len(data), time.perf_counter() - started)
+    return data
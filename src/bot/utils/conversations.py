@@ -0,0 +1,273 @@
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from collections import OrderedDict, deque
+import asyncio
+import json as JSON
+import logging
+import sqlite3
+import threading
+import time
+
+
+log: logging.Logger = logging.getLogger(__name__)
+
+summary_max_chars: int = 1500
+
+schema: str = '''
+CREATE TABLE IF NOT EXISTS conversations (
+    key TEXT PRIMARY KEY,
+    conversation_id TEXT,
+    summary TEXT NOT NULL DEFAULT '',
+    turns TEXT NOT NULL DEFAULT '[]',
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_last_used ON conversations (last_used);
+'''
+
+
+def estimate_tokens(text: str) -> int:
+    # about four characters a token for English, close enough for budgeting
+    return max(1, len(text) // 4)
+
+
+class Turn:
+    __slots__ = ('role', 'content', 'tokens')
+
+    def __init__(self, role: str, content: str) -> None:
+        self.role: str = role
+        self.content: str = content
+        self.tokens: int = estimate_tokens(content)
+
+    def to_dict(self) -> dict[str, str]:
+        return {'role': self.role, 'content': self.content}
+
+
+# (previous summary, turns being dropped) -> new summary
+Summarizer = Callable[[str, list[Turn]], Awaitable[str]]
+
+
+async def clip_summary(summary: str, dropped: list[Turn]) -> str:
+    """The default summarizer, keeps the start of every dropped turn."""
+
+    lines: list[str] = [summary] if summary else []
+    lines.extend(f'{turn.role}: {turn.content[:200]}' for turn in dropped)
+    return '\n'.join(lines)[-summary_max_chars:]
+
+
+class Conversation:
+    def __init__(
+        self,
+        key: str,
+        *,
+        conversation_id: Optional[str] = None,
+        summary: str = '',
+        turns: Iterable[Turn] = (),
+        last_used: Optional[float] = None
+    ) -> None:
+        self.key: str = key
+        # the API's id for this conversation, it already holds every turn we have
+        self.conversation_id: Optional[str] = conversation_id
+        self.summary: str = summary
+        self.turns: deque[Turn] = deque(turns)
+        self.last_used: float = last_used or time.time()
+        self.dirty: bool = False
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+    @property
+    def tokens(self) -> int:
+        # the summary is not counted, summarizers keep it to summary_max_chars
+        return sum(turn.tokens for turn in self.turns)
+
+    def request(self, prompt: str) -> dict[str, Any]:
+        if self.conversation_id:
+            return {'prompt': prompt, 'conversation_id': self.conversation_id}
+        # a new conversation on the API side, seeded from what we remember
+        return {
+            'prompt': prompt,
+            'summary': self.summary,
+            'history': [turn.to_dict() for turn in self.turns],
+        }
+
+
+class ConversationStore:
+    """Per channel and user chat memory.
+
+    Recent turns live in memory with the least recently used conversations
+    dropped past ``max_conversations``, and every conversation is also kept
+    in SQLite so it survives eviction and restarts. Turns past ``max_turns``
+    or ``token_budget`` are folded into the summary by the summarizers.
+    """
+
+    def __init__(
+        self,
+        path: str = 'conversations.db',
+        *,
+        max_conversations: int = 2000,
+        max_turns: int = 32,
+        token_budget: int = 1500,
+        idle_timeout: float = 1800,
+        retention: float = 7 * 24 * 3600,
+        sweep_interval: float = 300
+    ) -> None:
+        self.path: str = path
+        self.max_conversations: int = max_conversations
+        self.max_turns: int = max_turns
+        self.token_budget: int = token_budget
+        self.idle_timeout: float = idle_timeout
+        self.retention: float = retention
+        self.sweep_interval: float = sweep_interval
+        self.summarizers: list[Summarizer] = [clip_summary]
+        self.evictions: int = 0
+        self._conversations: OrderedDict[str, Conversation] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock: threading.Lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def key(channel_id: int, user_id: int) -> str:
+        return f'{channel_id}:{user_id}'
+
+    def _connect(self) -> None:
+        db: sqlite3.Connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(schema)
+        self._db = db
+
+    def _execute(self, query: str, args: tuple = ()) -> list[sqlite3.Row]:
+        assert self._db is not None
+        with self._lock:
+            return self._db.execute(query, args).fetchall()
+
+    async def execute(self, query: str, *args: Any) -> list[sqlite3.Row]:
+        return await asyncio.to_thread(self._execute, query, args)
+
+    async def open(self) -> None:
+        await asyncio.to_thread(self._connect)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sweeper())
+
+    def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+        if self._db:
+            # nothing is lost, everything dirty is written before a reply is sent
+            self._db.close()
+            self._db = None
+
+    def add_summarizer(self, summarizer: Summarizer) -> None:
+        self.summarizers.append(summarizer)
+
+    async def get(self, key: str) -> Conversation:
+        conversation: Optional[Conversation] = self._conversations.get(key)
+        if conversation is None:
+            rows: list[sqlite3.Row] = await self.execute('SELECT * FROM conversations WHERE key = ?', key)
+            if rows:
+                row: sqlite3.Row = rows[0]
+                conversation = Conversation(
+                    key,
+                    conversation_id=row['conversation_id'],
+                    summary=row['summary'],
+                    turns=[Turn(turn['role'], turn['content']) for turn in JSON.loads(row['turns'])],
+                    last_used=row['last_used']
+                )
+            else:
+                conversation = Conversation(key)
+            # a concurrent get may have loaded it while we were reading
+            conversation = self._conversations.setdefault(key, conversation)
+
+        self._conversations.move_to_end(key)
+        await self._evict_overflow()
+        return conversation
+
+    async def record(
+        self,
+        conversation: Conversation,
+        prompt: str,
+        response: str,
+        conversation_id: Optional[str]
+    ) -> None:
+        conversation.turns.append(Turn('user', prompt))
+        conversation.turns.append(Turn('assistant', response))
+        conversation.conversation_id = conversation_id
+        conversation.last_used = time.time()
+        conversation.dirty = True
+        await self.trim(conversation)
+        await self.save(conversation)
+
+    async def trim(self, conversation: Conversation) -> None:
+        dropped: list[Turn] = []
+        # whole exchanges go at once, and the latest one stays however long it is
+        while len(conversation.turns) > 2 and (
+            len(conversation.turns) > self.max_turns or conversation.tokens > self.token_budget
+        ):
+            dropped.append(conversation.turns.popleft())
+            if conversation.turns and conversation.turns[0].role != 'user':
+                dropped.append(conversation.turns.popleft())
+        if not dropped:
+            return
+
+        for summarizer in self.summarizers:
+            try:
+                conversation.summary = await summarizer(conversation.summary, dropped)
+            except Exception:
+                log.exception('Summarizer %r failed', summarizer)
+
+    async def save(self, conversation: Conversation) -> None:
+        await self.execute(
+            'INSERT INTO conversations (key, conversation_id, summary, turns, last_used) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET conversation_id = excluded.conversation_id, '
+            'summary = excluded.summary, turns = excluded.turns, last_used = excluded.last_used',
+            conversation.key,
+            conversation.conversation_id,
+            conversation.summary,
+            JSON.dumps([turn.to_dict() for turn in conversation.turns]),
+            conversation.last_used
+        )
+        conversation.dirty = False
+
+    async def reset(self, key: str) -> None:
+        self._conversations.pop(key, None)
+        await self.execute('DELETE FROM conversations WHERE key = ?', key)
+
+    async def _drop(self, key: str) -> None:
+        conversation: Conversation = self._conversations.pop(key)
+        if conversation.dirty:
+            await self.save(conversation)
+        self.evictions += 1
+
+    async def _evict_overflow(self) -> None:
+        # the newest one was just handed out, so it is about to be used as well
+        for key in list(self._conversations)[:-1]:
+            if len(self._conversations) <= self.max_conversations:
+                break
+            conversation: Optional[Conversation] = self._conversations.get(key)
+            # a locked conversation is mid-chat and will still be recorded and saved
+            if conversation is not None and not conversation.lock.locked():
+                await self._drop(key)
+
+    async def sweep(self) -> None:
+        now: float = time.time()
+        idle: list[str] = [
+            key for key, conversation in self._conversations.items()
+            if now - conversation.last_used > self.idle_timeout and not conversation.lock.locked()
+        ]
+        for key in idle:
+            await self._drop(key)
+        await self.execute('DELETE FROM conversations WHERE last_used < ?', now - self.retention)
+
+    async def _sweeper(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                log.exception('Conversation sweep failed')
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'in_memory': len(self._conversations),
+            'max_conversations': self.max_conversations,
+            'turns': sum(len(conversation.turns) for conversation in self._conversations.values()),
+            'evictions': self.evictions,
+        }
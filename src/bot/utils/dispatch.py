@@ -0,0 +1,125 @@
+from typing import Any
+
+import asyncio
+import contextvars
+import itertools
+import time
+
+
+high: int = 0
+normal: int = 1
+low: int = 2
+priority_names: dict[int, str] = {high: 'high', normal: 'normal', low: 'low'}
+
+# set per command invocation, inherited by every task the command starts
+current_priority: contextvars.ContextVar[int] = contextvars.ContextVar('current_priority', default=normal)
+
+
+def command_priority(command: Any) -> int:
+    while command is not None:
+        if any(getattr(check, 'mod_only', False) for check in getattr(command, 'checks', ())):
+            return high
+        command = getattr(command, 'parent', None)
+    return normal
+
+
+class PriorityStats:
+    def __init__(self) -> None:
+        self.active: int = 0
+        self.queued: int = 0
+        self.admitted: int = 0
+        self.delayed: int = 0
+        self.total_wait: float = 0.0
+        self.max_wait: float = 0.0
+
+    def record(self, waited: float) -> None:
+        self.admitted += 1
+        if waited > 0:
+            self.delayed += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'admitted': self.admitted,
+            'delayed': self.delayed,
+            'avg_wait': self.total_wait / self.delayed if self.delayed else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class Dispatcher:
+    """Hands out API connection slots by priority.
+
+    High priority work may use every slot, normal work leaves ``reserved``
+    slots free for it, and low priority work is further capped at
+    ``low_limit`` slots. Waiters are woken highest priority first, then in
+    arrival order.
+    """
+
+    def __init__(self, capacity: int, *, reserved: int = 5, low_limit: int = 10) -> None:
+        self.capacity: int = capacity
+        self.reserved: int = min(reserved, capacity - 1)
+        self.low_limit: int = max(1, min(low_limit, capacity - self.reserved))
+        self.active: int = 0
+        self.stats: dict[int, PriorityStats] = {priority: PriorityStats() for priority in priority_names}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def _admissible(self, priority: int) -> bool:
+        if priority == high:
+            return self.active < self.capacity
+        if self.active >= self.capacity - self.reserved:
+            return False
+        return priority != low or self.stats[low].active < self.low_limit
+
+    def _take(self, priority: int) -> None:
+        self.active += 1
+        self.stats[priority].active += 1
+
+    def release(self, priority: int) -> None:
+        self.active -= 1
+        self.stats[priority].active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        for waiter in sorted(self._waiters, key=lambda waiter: waiter[:2]):
+            priority, _, future = waiter
+            if future.done() or not self._admissible(priority):
+                continue
+            self._waiters.remove(waiter)
+            self._take(priority)
+            future.set_result(None)
+
+    async def acquire(self, priority: int) -> float:
+        ahead: bool = any(waiter[0] <= priority for waiter in self._waiters)
+        if not ahead and self._admissible(priority):
+            self._take(priority)
+            self.stats[priority].record(0.0)
+            return 0.0
+
+        started: float = time.monotonic()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        waiter: tuple[int, int, asyncio.Future] = (priority, next(self._seq), future)
+        self._waiters.append(waiter)
+        self.stats[priority].queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # granted a slot but cancelled before getting to use it
+                self.release(priority)
+            else:
+                self._waiters.remove(waiter)
+            raise
+        finally:
+            self.stats[priority].queued -= 1
+
+        waited: float = time.monotonic() - started
+        self.stats[priority].record(waited)
+        return waited
+
+    def to_dict(self) -> dict[str, dict[str, Any]]:
+        return {priority_names[priority]: stats.to_dict() for priority, stats in self.stats.items()}
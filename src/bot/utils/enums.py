@@ -1,8 +1,10 @@
 from enum import Enum
+import os
 from .config import Config
 
 
-api_url: str = 'https://api.rac-corp.net/'
+# RAC_API_URL points the bot at another deployment, e.g. the local stand-in
+api_url: str = os.environ.get('RAC_API_URL', 'https://api.rac-corp.net/')
 api_headers: dict[str, str] = {
     'Authorization': Config.api_key(),
     'User-Agent': 'RAC-Bot'
@@ -12,6 +14,16 @@ api_headers: dict[str, str] = {
 class CommandSignatures(Enum):
     iisr_temp_ban = '-target <str> -duration <str> -serverid <str> -reason <str?>'
     iisr_perm_ban = '-target <str> -serverid <str> -reason <str?>'
+    iisr_temp_ban_batch = '-targets <str?> -duration <str> -serverid <str> -reason <str?> [attachment?]'
+    iisr_perm_ban_batch = '-targets <str?> -serverid <str> -reason <str?> [attachment?]'
+    iisr_kick_batch = '-targets <str?> -reason <str?> [attachment?]'
+
+
+# endpoints kept out of their name's group, so they get their own breaker and rate limit
+group_overrides: dict[str, str] = {
+    # background moderation must not open the breaker or spend the budget of user facing AI
+    'ai_moderation_text': 'moderation',
+}
 
 
 class Endpoints(Enum):
@@ -66,4 +78,11 @@ class Endpoints(Enum):
     utility_uptime = api_url + 'utilities/uptime'
     utility_tasks = api_url + 'utilities/tasks'
 
-    # TODO: other endpoints
\ No newline at end of file
+    # TODO: other endpoints
+
+    @property
+    def group(self) -> str:
+        # ai, bot, fun, iisr, roguessr or utility, or one of the group_overrides
+        if self.name in group_overrides:
+            return group_overrides[self.name]
+        return self.name.split('_', 1)[0].rstrip('0123456789')
\ No newline at end of file
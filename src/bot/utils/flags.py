@@ -12,4 +12,22 @@ class IISRTempBanFlags(commands.FlagConverter, case_insensitive=True, prefix='-'
 class IISRPermBanFlags(commands.FlagConverter, case_insensitive=True, prefix='-', delimiter=' '):
     target: str
     serverid: str
+    reason: Optional[str] = None
+
+
+class IISRBatchTempBanFlags(commands.FlagConverter, case_insensitive=True, prefix='-', delimiter=' '):
+    targets: Optional[str] = None
+    duration: str
+    serverid: str
+    reason: Optional[str] = None
+
+
+class IISRBatchPermBanFlags(commands.FlagConverter, case_insensitive=True, prefix='-', delimiter=' '):
+    targets: Optional[str] = None
+    serverid: str
+    reason: Optional[str] = None
+
+
+class IISRBatchKickFlags(commands.FlagConverter, case_insensitive=True, prefix='-', delimiter=' '):
+    targets: Optional[str] = None
     reason: Optional[str] = None
\ No newline at end of file
@@ -1,58 +1,548 @@
 from typing import Union, Any, Optional
 
 import aiohttp
+import asyncio
 import json as JSON
+import time
+import weakref
+from tempfile import SpooledTemporaryFile
 
+from .breaker import CircuitBreaker
+from .cache import TTLCache
+from . import codec
+from .dispatch import Dispatcher, current_priority, high, low
 from .enums import Endpoints
+from .ratelimit import RateLimiter
+from .retry import LatencyTracker, RetryPolicy, no_retry, parse_retry_after
+from .streaming import EventStream
+
+
+# streamed image bodies stay in memory up to image_spool_size, then go to disk
+image_max_size: int = 8 * 1024 * 1024
+image_spool_size: int = 1024 * 1024
+image_chunk_size: int = 64 * 1024
+
+# methods a read can use; kicks and announcements are GETs too, so a safe method
+# alone does not make a call safe to share, retry or cache
+safe_methods: frozenset[str] = frozenset({'get', 'head', 'options'})
+
+# seconds a successful GET response stays cached for
+cache_ttls: dict[Endpoints, float] = {
+    Endpoints.roguessr_game_maps: 600,
+    Endpoints.iisr_bans: 30,
+    Endpoints.iisr_server_info: 5,
+    Endpoints.roguessr_server_info: 5,
+    Endpoints.utility_usage: 10,
+}
+
+# cached endpoints that become stale once a mutating endpoint succeeds
+cache_invalidations: dict[Endpoints, tuple[Endpoints, ...]] = {
+    Endpoints.iisr_temp_ban_create: (Endpoints.iisr_bans,),
+    Endpoints.iisr_perm_ban_create: (Endpoints.iisr_bans,),
+    Endpoints.iisr_temp_ban_all_servers: (Endpoints.iisr_bans,),
+    Endpoints.iisr_perm_ban_all_servers: (Endpoints.iisr_bans,),
+    Endpoints.iisr_ban_remove: (Endpoints.iisr_bans,),
+    Endpoints.iisr_ban_remove_all_servers: (Endpoints.iisr_bans,),
+    Endpoints.iisr_kick: (Endpoints.iisr_server_info,),
+    Endpoints.iisr_kick_all: (Endpoints.iisr_server_info,),
+    Endpoints.iisr_server_shutdown: (Endpoints.iisr_server_info,),
+    Endpoints.iisr_server_lock: (Endpoints.iisr_server_info,),
+    Endpoints.iisr_server_unlock: (Endpoints.iisr_server_info,),
+    Endpoints.roguessr_server_shutdown: (Endpoints.roguessr_server_info,),
+    Endpoints.roguessr_game_change_map: (Endpoints.roguessr_server_info,),
+}
+
+# attempts cap per endpoint, only the read-only endpoints listed here are retried;
+# a mutating call listed here is still sent once unless it carries an Idempotency-Key
+# header, and the outbox replays the ones that are queued
+default_retry_policy: RetryPolicy = no_retry
+retry_policies: dict[Endpoints, RetryPolicy] = {
+    Endpoints.iisr_server_info: RetryPolicy(attempts=3, hedge=True),
+    Endpoints.roguessr_server_info: RetryPolicy(attempts=3, hedge=True),
+    Endpoints.utility_ping: RetryPolicy(attempts=2, hedge=True, hedge_delay=0.3),
+    Endpoints.iisr_bans: RetryPolicy(attempts=3),
+    Endpoints.roguessr_game_maps: RetryPolicy(attempts=3),
+    Endpoints.utility_usage: RetryPolicy(attempts=3),
+    Endpoints.utility_uptime: RetryPolicy(attempts=2),
+    Endpoints.utility_tasks: RetryPolicy(attempts=2),
+}
+
+# endpoints that only read, the only ones whose calls are shared between callers,
+# cached or retried without an Idempotency-Key; the cached endpoints are among them
+read_endpoints: frozenset[Endpoints] = frozenset({
+    *cache_ttls,
+    Endpoints.ai_cai_history,
+    Endpoints.utility_ping,
+    Endpoints.utility_uptime,
+    Endpoints.utility_tasks,
+})
+
+
+def is_read(endpoint: Endpoints, method: str) -> bool:
+    return endpoint in read_endpoints and method.lower() in safe_methods
+
+
+def request_key(
+    endpoint: Endpoints,
+    method: str,
+    params: dict[str, Any],
+    json: dict[str, Any]
+) -> tuple[str, str, str, str]:
+    return (
+        endpoint.name,
+        method.lower(),
+        JSON.dumps(params, sort_keys=True, default=str),
+        JSON.dumps(json, sort_keys=True, default=str)
+    )
 
 
 class Functions:
     def __init__(self, bot, disabled: bool = False) -> None:
         self.bot = bot
-        self.disabled: bool = disabled
+        self.forced_disabled: bool = disabled
+        self.breakers: dict[str, CircuitBreaker] = {
+            group: CircuitBreaker(group) for group in {endpoint.group for endpoint in Endpoints}
+        }
+        self.cache: TTLCache = TTLCache(max_entries=512, max_bytes=4 * 1024 * 1024)
+        self.limiter: RateLimiter = RateLimiter()
+        # every API call goes to the same host, so the per-host limit is the real pool size
+        self.dispatcher: Dispatcher = Dispatcher(bot.connector_settings.limit_per_host, reserved=5, low_limit=10)
+        self.coalesced: int = 0
+        self.retries: int = 0
+        self.hedges: int = 0
+        self.latencies: dict[Endpoints, LatencyTracker] = {}
+        self._abandoned: weakref.WeakSet[asyncio.Task] = weakref.WeakSet()
+        self._inflight: dict[tuple[str, str, str, str], asyncio.Task] = {}
+        # callers still waiting on each shared request
+        self._waiters: dict[asyncio.Task, int] = {}
+
+    @property
+    def disabled(self) -> bool:
+        # recovery mode kicks in by itself once every endpoint group is failing
+        if self.forced_disabled:
+            return True
+        return all(breaker.state == CircuitBreaker.open for breaker in self.breakers.values())
+
+    @disabled.setter
+    def disabled(self, value: bool) -> None:
+        self.forced_disabled = value
+
+    def invalidate(self, endpoint: Endpoints) -> int:
+        return self.cache.invalidate_tag(endpoint)
+
+    def abandon(self, task: asyncio.Task) -> None:
+        # cancelled on purpose, so its request is not counted as an API failure
+        self._abandoned.add(task)
+        task.cancel()
+
+    def breaker(self, endpoint: Endpoints) -> CircuitBreaker:
+        return self.breakers[endpoint.group]
+
+    def unavailable(self, breaker: CircuitBreaker) -> tuple[int, str, str]:
+        return (
+            503, 
+            'Service Unavailable', 
+            f'The {breaker.name} API is unavailable, try again in {breaker.retry_after:.0f} seconds'
+        )
+
+    def record(self, breaker: CircuitBreaker, status: int) -> None:
+        if status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
 
     async def get_body(self, response: aiohttp.ClientResponse) -> Union[Any, str]:
-        try:
-            body = await response.json()
-            return body
-        except:
-            body = await response.text()
-            return body
-        
+        raw: bytes = await response.read()
+        content_type: str = response.content_type
+        if content_type == 'application/json' or content_type.endswith('+json'):
+            try:
+                return await codec.decode_json(raw)
+            except ValueError:
+                pass
+        return codec.decode_text(raw, response.charset or 'utf-8')
+
     async def endpoint_request(
-        self, 
-        endpoint: Endpoints, 
+        self,
+        endpoint: Endpoints,
         method: str = 'get',
-        /, 
+        /,
         *,
-        headers: dict[str, Any] = {}, 
-        json: dict[str, Any] = {}, 
-        params: dict[str, Any] = {}
+        headers: dict[str, Any] = {},
+        json: dict[str, Any] = {},
+        params: dict[str, Any] = {},
+        use_cache: bool = True,
+        timeout: Optional[aiohttp.ClientTimeout] = None
     ) -> tuple[int, Optional[str], Union[str, Any]]:
         if self.disabled:
             return (500, 'Internal Server Error', 'The system is in recovery mode')
 
-        async with self.bot.session.request(
-            method, endpoint.value, headers=headers, json=json, params=params
-        ) as resp:
-            body: Union[str, Any] = await self.get_body(resp)
-            return (resp.status, resp.reason, body)
-        
+        if not is_read(endpoint, method):
+            return await self._send(
+                endpoint, method, None, headers=headers, json=json, params=params, timeout=timeout
+            )
+
+        key: tuple[str, str, str, str] = request_key(endpoint, method, params, json)
+        if use_cache and endpoint in cache_ttls:
+            cached: Optional[tuple[int, Optional[str], Any]] = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        # identical reads already on the wire share one response
+        task: Optional[asyncio.Task] = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._send(endpoint, method, key, headers=headers, json=json, params=params, timeout=timeout)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish_inflight(key, done))
+        else:
+            self.coalesced += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # shielded so one caller timing out does not cancel the others
+            return await asyncio.shield(task)
+        finally:
+            waiters: int = self._waiters.pop(task, 1) - 1
+            if waiters:
+                self._waiters[task] = waiters
+            elif not task.done():
+                # the last caller has gone, nobody is left to use the response
+                self.abandon(task)
+
+    def _finish_inflight(self, key: tuple[str, str, str, str], task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception() # mark as retrieved when every waiter has gone away
+
+    def retry_policy(self, endpoint: Endpoints, method: str, headers: dict[str, Any]) -> RetryPolicy:
+        policy: RetryPolicy = retry_policies.get(endpoint, default_retry_policy)
+        if is_read(endpoint, method):
+            return policy
+        # mutating calls are only replayed when the API can dedupe them
+        if 'Idempotency-Key' in headers:
+            return RetryPolicy(
+                attempts=policy.attempts, 
+                base_delay=policy.base_delay, 
+                max_delay=policy.max_delay,
+                retry_statuses=policy.retry_statuses
+            )
+        return no_retry
+
+    def priority(self, endpoint: Endpoints, reader: str) -> int:
+        priority: int = current_priority.get()
+        # AI and image calls hold a connection for seconds, keep them to their share
+        if priority != high and (endpoint.group == 'ai' or reader != 'body'):
+            return low
+        return priority
+
+    def latency(self, endpoint: Endpoints) -> LatencyTracker:
+        tracker: Optional[LatencyTracker] = self.latencies.get(endpoint)
+        if tracker is None:
+            tracker = self.latencies[endpoint] = LatencyTracker()
+        return tracker
+
+    async def _send(
+        self,
+        endpoint: Endpoints,
+        method: str,
+        key: Optional[tuple[str, str, str, str]],
+        *,
+        headers: dict[str, Any],
+        json: dict[str, Any],
+        params: dict[str, Any],
+        reader: str = 'body',
+        max_size: Optional[int] = None,
+        timeout: Optional[aiohttp.ClientTimeout] = None
+    ) -> tuple[int, Optional[str], Union[str, Any]]:
+        policy: RetryPolicy = self.retry_policy(endpoint, method, headers)
+        # encoded once here rather than by aiohttp on every attempt
+        kwargs: dict[str, Any] = dict(
+            headers={**headers, 'Content-Type': 'application/json'},
+            data=codec.encode_json(json),
+            params=params,
+            reader=reader,
+            max_size=max_size,
+            timeout=timeout
+        )
+        breaker: CircuitBreaker = self.breaker(endpoint)
+
+        attempt: int = 0
+        while True:
+            attempt += 1
+            body: Union[str, Any] = None
+            try:
+                if policy.hedge:
+                    status, reason, body, retry_after = await self._hedged(endpoint, method, policy, **kwargs)
+                else:
+                    status, reason, body, retry_after = await self._attempt(endpoint, method, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= policy.attempts or breaker.state == CircuitBreaker.open:
+                    raise
+                delay: float = policy.backoff(attempt)
+            else:
+                if (
+                    status not in policy.retry_statuses 
+                    or attempt >= policy.attempts 
+                    or breaker.state == CircuitBreaker.open
+                ):
+                    break
+                delay = max(policy.backoff(attempt), retry_after or 0.0)
+                if delay > policy.max_delay:
+                    break
+
+            if hasattr(body, 'close'):
+                body.close()
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+        result: tuple[int, Optional[str], Union[str, Any]] = (status, reason, body)
+        if status in self.bot.variables['ok_status_codes']:
+            ttl: Optional[float] = cache_ttls.get(endpoint)
+            if key is not None and ttl:
+                self.cache.set(key, result, ttl, tag=endpoint)
+            for stale in cache_invalidations.get(endpoint, ()):
+                self.invalidate(stale)
+        return result
+
+    async def _hedged(
+        self,
+        endpoint: Endpoints,
+        method: str,
+        policy: RetryPolicy,
+        **kwargs: Any
+    ) -> tuple[int, Optional[str], Union[str, Any], Optional[float]]:
+        delay: float = self.latency(endpoint).percentile(0.95) or policy.hedge_delay
+        delay = max(policy.min_hedge_delay, delay)
+
+        first: asyncio.Task = asyncio.ensure_future(self._attempt(endpoint, method, **kwargs))
+        attempts: list[asyncio.Task] = [first]
+        ok_status_codes: list[int] = self.bot.variables['ok_status_codes']
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result()
+
+            self.hedges += 1
+            attempts.append(asyncio.ensure_future(self._attempt(endpoint, method, **kwargs)))
+            pending: set[asyncio.Task] = set(attempts)
+            finished: list[asyncio.Task] = []
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result()[0] in ok_status_codes:
+                        return task.result()
+                finished.extend(done)
+                if not pending:
+                    # neither got through, report the last answer the API gave if there was one
+                    answered: list[asyncio.Task] = [task for task in finished if task.exception() is None]
+                    return (answered or finished)[-1].result()
+        finally:
+            # the caller may have gone during the hedge delay, which leaves the first attempt running too
+            for task in attempts:
+                if not task.done():
+                    self.abandon(task)
+
+    async def _attempt(
+        self,
+        endpoint: Endpoints,
+        method: str,
+        *,
+        headers: dict[str, Any],
+        data: bytes,
+        params: dict[str, Any],
+        reader: str = 'body',
+        max_size: Optional[int] = None,
+        timeout: Optional[aiohttp.ClientTimeout] = None
+    ) -> tuple[int, Optional[str], Union[str, Any], Optional[float]]:
+        breaker: CircuitBreaker = self.breaker(endpoint)
+        # an open breaker still fails fast instead of waiting for a turn first
+        if breaker.retry_after > 0:
+            breaker.rejected += 1
+            return self.unavailable(breaker) + (None,)
+
+        # queued before asking the breaker, so a half-open probe is only taken by
+        # a call that is about to go out, and a caller giving up while waiting
+        # for its turn is not counted as an API failure
+        await self.limiter.acquire(endpoint)
+        priority: int = self.priority(endpoint, reader)
+        await self.dispatcher.acquire(priority)
+        if not breaker.allow():
+            self.dispatcher.release(priority)
+            return self.unavailable(breaker) + (None,)
+
+        recorded: bool = False
+        try:
+            options: dict[str, Any] = {'timeout': timeout} if timeout is not None else {}
+            started: float = time.perf_counter()
+            try:
+                async with self.bot.session.request(
+                    method, endpoint.value, headers=headers, data=data, params=params, **options
+                ) as resp:
+                    ok: bool = resp.status in self.bot.variables['ok_status_codes']
+                    if reader == 'stream' and ok:
+                        body: Union[str, Any] = await self.read_stream(resp, max_size or image_max_size)
+                    elif reader == 'bytes' and ok:
+                        body = await resp.read()
+                    else:
+                        body = await self.get_body(resp)
+                    retry_after: Optional[float] = parse_retry_after(resp.headers.get('Retry-After'))
+                    self.limiter.update(endpoint, resp.status, resp.headers)
+            except asyncio.CancelledError:
+                # callers only cancel once their deadline has passed, unless this
+                # was the slower half of a hedged pair
+                if asyncio.current_task() not in self._abandoned:
+                    breaker.record_failure()
+                    recorded = True
+                raise
+            except Exception:
+                breaker.record_failure()
+                recorded = True
+                raise
+            finally:
+                self.dispatcher.release(priority)
+
+            self.latency(endpoint).add(time.perf_counter() - started)
+            self.record(breaker, resp.status)
+            recorded = True
+        finally:
+            if not recorded:
+                breaker.release_probe()
+
+        if reader == 'stream' and ok and isinstance(body, str):
+            return (413, 'Payload Too Large', body, None)
+        return (resp.status, resp.reason, body, retry_after)
+
     async def image_request(
-        self, 
-        endpoint: Endpoints, 
+        self,
+        endpoint: Endpoints,
         method: str = 'get',
-        /, 
+        /,
+        *,
+        headers: dict[str, Any] = {},
+        json: dict[str, Any] = {},
+        params: dict[str, Any] = {},
+        stream: bool = False,
+        max_size: Optional[int] = None,
+        timeout: Optional[aiohttp.ClientTimeout] = None
+    ) -> tuple[int, Optional[str], Union[str, bytes, SpooledTemporaryFile]]:
+        """Requests an image from the API.
+
+        With ``stream`` the body is read in chunks into a spooled temporary
+        file, which can be handed straight to ``discord.File``, and bodies
+        larger than ``max_size`` are rejected with a 413 before they are
+        fully downloaded.
+        """
+
+        if self.disabled:
+            return (500, 'Internal Server Error', 'The system is in recovery mode')
+
+        return await self._send(
+            endpoint, 
+            method, 
+            None, 
+            headers=headers, 
+            json=json, 
+            params=params, 
+            reader='stream' if stream else 'bytes',
+            max_size=max_size,
+            timeout=timeout
+        )
+
+    async def stream_request(
+        self,
+        endpoint: Endpoints,
+        method: str = 'post',
+        /,
         *,
-        headers: dict[str, Any] = {}, 
-        json: dict[str, Any] = {}, 
-        params: dict[str, Any] = {}
-    ) -> tuple[int, Optional[str], Union[str, bytes]]:
+        headers: dict[str, Any] = {},
+        json: dict[str, Any] = {},
+        params: dict[str, Any] = {},
+        timeout: Optional[aiohttp.ClientTimeout] = None
+    ) -> tuple[int, Optional[str], Union[str, Any, EventStream]]:
+        """Requests a server-sent events response from the API.
+
+        A successful ``text/event-stream`` response comes back as an
+        ``EventStream`` that keeps its connection slot until it is read to
+        the end or closed. Any other response is decoded like
+        ``endpoint_request``. Streams are never retried or cached.
+        """
+
         if self.disabled:
             return (500, 'Internal Server Error', 'The system is in recovery mode')
 
-        async with self.bot.session.request(
-            method, endpoint.value, headers=headers, json=json, params=params
-        ) as resp:
-            body: Union[str, Any] = await resp.read()
-            return (resp.status, resp.reason, body)
\ No newline at end of file
+        breaker: CircuitBreaker = self.breaker(endpoint)
+        if breaker.retry_after > 0:
+            breaker.rejected += 1
+            return self.unavailable(breaker)
+
+        # the probe is taken once the call has its turn, as in _attempt
+        await self.limiter.acquire(endpoint)
+        priority: int = self.priority(endpoint, 'stream')
+        await self.dispatcher.acquire(priority)
+        if not breaker.allow():
+            self.dispatcher.release(priority)
+            return self.unavailable(breaker)
+
+        options: dict[str, Any] = {'timeout': timeout} if timeout is not None else {}
+        started: float = time.perf_counter()
+        try:
+            resp: aiohttp.ClientResponse = await self.bot.session.request(
+                method,
+                endpoint.value,
+                headers={**headers, 'Content-Type': 'application/json', 'Accept': 'text/event-stream'},
+                data=codec.encode_json(json),
+                params=params,
+                **options
+            )
+        except (Exception, asyncio.CancelledError):
+            # an abandoned stream, e.g. a cancelled AI job, says nothing about the API
+            if asyncio.current_task() in self._abandoned:
+                breaker.release_probe()
+            else:
+                breaker.record_failure()
+            self.dispatcher.release(priority)
+            raise
+
+        # time to the first byte, the rest depends on how much the model writes
+        self.latency(endpoint).add(time.perf_counter() - started)
+        self.limiter.update(endpoint, resp.status, resp.headers)
+        self.record(breaker, resp.status)
+
+        if resp.status in self.bot.variables['ok_status_codes'] and resp.content_type == 'text/event-stream':
+            def release(failed: bool) -> None:
+                if failed:
+                    breaker.record_failure()
+                self.dispatcher.release(priority)
+
+            return (resp.status, resp.reason, EventStream(resp, release))
+
+        try:
+            body: Union[str, Any] = await self.get_body(resp)
+        finally:
+            resp.release()
+            self.dispatcher.release(priority)
+        return (resp.status, resp.reason, body)
+
+    async def read_stream(self, response: aiohttp.ClientResponse, max_size: int) -> Union[str, SpooledTemporaryFile]:
+        if response.content_length is not None and response.content_length > max_size:
+            response.close()
+            return f'Response body too large ({response.content_length} > {max_size} bytes)'
+
+        spool: SpooledTemporaryFile = SpooledTemporaryFile(max_size=image_spool_size)
+        size: int = 0
+        try:
+            async for chunk in response.content.iter_chunked(image_chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    spool.close()
+                    response.close()
+                    return f'Response body too large (over {max_size} bytes)'
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+
+        spool.seek(0)
+        return spool
@@ -0,0 +1,147 @@
+from typing import Any, Optional
+
+import aiohttp
+import ssl
+import time
+from types import SimpleNamespace
+
+
+class ConnectorSettings:
+    def __init__(
+        self,
+        *,
+        limit: int = 100,
+        limit_per_host: int = 30,
+        keepalive_timeout: float = 30.0,
+        ttl_dns_cache: Optional[int] = 300,
+        use_dns_cache: bool = True
+    ) -> None:
+        self.limit: int = limit
+        self.limit_per_host: int = limit_per_host
+        self.keepalive_timeout: float = keepalive_timeout
+        self.ttl_dns_cache: Optional[int] = ttl_dns_cache
+        self.use_dns_cache: bool = use_dns_cache
+
+
+class PoolStats:
+    def __init__(self) -> None:
+        self.connector: Optional[aiohttp.TCPConnector] = None
+        self.requests: int = 0
+        self.created: int = 0
+        self.reused: int = 0
+        self.waits: int = 0
+        self.waiting: int = 0
+        self.wait_time: float = 0.0
+        self.connect_time: float = 0.0
+        self.dns_hits: int = 0
+        self.dns_misses: int = 0
+
+    @property
+    def in_use(self) -> int:
+        if self.connector is None:
+            return 0
+        return len(getattr(self.connector, '_acquired', ()))
+
+    @property
+    def idle(self) -> int:
+        if self.connector is None:
+            return 0
+        conns: dict[Any, list] = getattr(self.connector, '_conns', {})
+        return sum(len(entries) for entries in conns.values())
+
+    @property
+    def limit(self) -> int:
+        return self.connector.limit if self.connector else 0
+
+    @property
+    def limit_per_host(self) -> int:
+        return self.connector.limit_per_host if self.connector else 0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'limit_per_host': self.limit_per_host,
+            'in_use': self.in_use,
+            'idle': self.idle,
+            'requests': self.requests,
+            'created': self.created,
+            'reused': self.reused,
+            'waits': self.waits,
+            'waiting': self.waiting,
+            'avg_wait_ms': (self.wait_time / self.waits * 1000) if self.waits else 0.0,
+            'avg_connect_ms': (self.connect_time / self.created * 1000) if self.created else 0.0,
+            'dns_hits': self.dns_hits,
+            'dns_misses': self.dns_misses,
+        }
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx: SimpleNamespace, params) -> None:
+            self.requests += 1
+
+        async def on_queued_start(session, ctx: SimpleNamespace, params) -> None:
+            ctx.queued_at = time.perf_counter()
+            self.waits += 1
+            self.waiting += 1
+
+        async def on_queued_end(session, ctx: SimpleNamespace, params) -> None:
+            self.waiting -= 1
+            self.wait_time += time.perf_counter() - getattr(ctx, 'queued_at', time.perf_counter())
+
+        async def on_create_start(session, ctx: SimpleNamespace, params) -> None:
+            ctx.connect_at = time.perf_counter()
+
+        async def on_create_end(session, ctx: SimpleNamespace, params) -> None:
+            self.created += 1
+            self.connect_time += time.perf_counter() - getattr(ctx, 'connect_at', time.perf_counter())
+
+        async def on_reuse(session, ctx: SimpleNamespace, params) -> None:
+            self.reused += 1
+
+        async def on_dns_hit(session, ctx: SimpleNamespace, params) -> None:
+            self.dns_hits += 1
+
+        async def on_dns_miss(session, ctx: SimpleNamespace, params) -> None:
+            self.dns_misses += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_start.append(on_create_start)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_dns_cache_hit.append(on_dns_hit)
+        trace.on_dns_cache_miss.append(on_dns_miss)
+        return trace
+
+
+def create_connector(settings: ConnectorSettings) -> aiohttp.TCPConnector:
+    # one context for every connection so the CA store is loaded once and
+    # the handshake state is shared instead of rebuilt per connection
+    context: ssl.SSLContext = ssl.create_default_context()
+    context.options |= ssl.OP_NO_COMPRESSION
+
+    return aiohttp.TCPConnector(
+        limit=settings.limit,
+        limit_per_host=settings.limit_per_host,
+        keepalive_timeout=settings.keepalive_timeout,
+        ttl_dns_cache=settings.ttl_dns_cache,
+        use_dns_cache=settings.use_dns_cache,
+        ssl=context
+    )
+
+
+def create_session(
+    settings: ConnectorSettings,
+    stats: PoolStats,
+    *,
+    timeout: aiohttp.ClientTimeout
+) -> aiohttp.ClientSession:
+    connector: aiohttp.TCPConnector = create_connector(settings)
+    stats.connector = connector
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        trace_configs=[stats.trace_config()]
+    )
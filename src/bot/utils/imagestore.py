@@ -0,0 +1,273 @@
+from typing import Any, AsyncContextManager, Optional, Union
+
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import contextlib
+import hashlib
+import io
+import json as JSON
+import mmap
+import os
+import shutil
+import time
+
+from .enums import Endpoints
+from .reencode import ImageEncoder
+
+
+def image_key(endpoint: Endpoints, json: dict[str, Any]) -> str:
+    raw: str = JSON.dumps([endpoint.name, json], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def url_expiry(url: str) -> Optional[float]:
+    # signed Discord CDN links carry their expiry as hex seconds in ?ex=
+    ex: list[str] = parse_qs(urlsplit(url).query).get('ex', [])
+    try:
+        return float(int(ex[0], 16)) if ex else None
+    except ValueError:
+        return None
+
+
+def image_format(fp: io.IOBase) -> str:
+    # the file extension Discord needs to show the image inline
+    start: int = fp.tell()
+    header: bytes = fp.read(12)
+    fp.seek(start)
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'webp'
+    if header.startswith(b'\xff\xd8'):
+        return 'jpeg'
+    return 'png'
+
+
+class MappedImage(io.RawIOBase):
+    """A read-only file object over a memory-mapped image on disk."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        with open(path, 'rb') as fp:
+            self._map: mmap.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        data: bytes = self._map.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self) -> int:
+        return self._map.tell()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._map.close()
+        super().close()
+
+
+class StoredImage:
+    __slots__ = ('size', 'url', 'expires')
+
+    def __init__(self, size: int, url: Optional[str] = None) -> None:
+        self.size: int = size
+        self.url: Optional[str] = url
+        self.expires: Optional[float] = url_expiry(url) if url else None
+
+
+class ImageStore:
+    """Generated images on disk, named by the hash of the request that made them.
+
+    The least recently used images are removed once the store grows past
+    ``max_bytes``. The Discord CDN link of an image's last upload is kept
+    next to it so a repeat can link to it instead of uploading it again.
+    With an ``encoder`` new images are re-encoded once, before they are
+    stored, and keep the ``.png`` name whatever format they end up in.
+    """
+
+    def __init__(
+        self,
+        directory: str = 'image_cache',
+        *,
+        max_bytes: int = 256 * 1024 * 1024,
+        encoder: Optional[ImageEncoder] = None
+    ) -> None:
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.encoder: Optional[ImageEncoder] = encoder
+        self.size: int = 0
+        self.hits: int = 0
+        self.url_hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._entries: OrderedDict[str, StoredImage] = OrderedDict()
+
+    def path(self, key: str, suffix: str = '.png') -> str:
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _scan(self) -> list[tuple[float, str, StoredImage]]:
+        found: list[tuple[float, str, StoredImage]] = []
+        os.makedirs(self.directory, exist_ok=True)
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith('.png'):
+                    continue
+                key: str = entry.name[:-4]
+                url: Optional[str] = None
+                try:
+                    with open(self.path(key, '.url'), encoding='utf-8') as fp:
+                        url = fp.read().strip() or None
+                except FileNotFoundError:
+                    pass
+                stat: os.stat_result = entry.stat()
+                found.append((stat.st_mtime, key, StoredImage(stat.st_size, url)))
+        return sorted(found, key=lambda item: item[0])
+
+    async def open(self) -> None:
+        self._entries.clear()
+        self.size = 0
+        for _, key, stored in await asyncio.to_thread(self._scan):
+            self._entries[key] = stored
+            self.size += stored.size
+        await self._evict()
+
+    def url(self, key: str) -> Optional[str]:
+        stored: Optional[StoredImage] = self._entries.get(key)
+        if stored is None or stored.url is None:
+            return None
+        if stored.expires is not None and stored.expires - 60 <= time.time():
+            return None
+        self._entries.move_to_end(key)
+        self.url_hits += 1
+        return stored.url
+
+    def _open(self, key: str) -> MappedImage:
+        path: str = self.path(key)
+        # the modified time doubles as the LRU order after a restart
+        os.utime(path)
+        return MappedImage(path)
+
+    async def get(self, key: str) -> Optional[MappedImage]:
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        try:
+            image: MappedImage = await asyncio.to_thread(self._open, key)
+        except (FileNotFoundError, ValueError):
+            # removed from under us, or empty and so not mappable
+            self._forget(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def _write(self, key: str, fp: io.IOBase) -> int:
+        path: str = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp: str = f'{path}.tmp'
+        start: int = fp.tell()
+        with open(temp, 'wb') as out:
+            shutil.copyfileobj(fp, out)
+            size: int = out.tell()
+        os.replace(temp, path)
+        fp.seek(start)
+        return size
+
+    async def put(self, key: str, fp: io.IOBase) -> None:
+        size: int = await asyncio.to_thread(self._write, key, fp)
+        if key in self._entries:
+            self.size -= self._entries[key].size
+        self._entries[key] = StoredImage(size)
+        self.size += size
+        await self._evict()
+
+    def _write_url(self, key: str, url: str) -> None:
+        with open(self.path(key, '.url'), 'w', encoding='utf-8') as fp:
+            fp.write(url)
+
+    async def remember(self, key: str, message: Any) -> None:
+        stored: Optional[StoredImage] = self._entries.get(key)
+        if stored is None or not getattr(message, 'attachments', None):
+            return
+        url: str = message.attachments[0].url
+        self._entries[key] = StoredImage(stored.size, url)
+        await asyncio.to_thread(self._write_url, key, url)
+
+    def _forget(self, key: str) -> None:
+        stored: Optional[StoredImage] = self._entries.pop(key, None)
+        if stored is not None:
+            self.size -= stored.size
+
+    def _delete(self, keys: list[str]) -> None:
+        for key in keys:
+            for suffix in ('.png', '.url'):
+                try:
+                    os.remove(self.path(key, suffix))
+                except FileNotFoundError:
+                    pass
+
+    async def _evict(self) -> None:
+        evicted: list[str] = []
+        while self.size > self.max_bytes and self._entries:
+            key, stored = self._entries.popitem(last=False)
+            self.size -= stored.size
+            evicted.append(key)
+        if evicted:
+            self.evictions += len(evicted)
+            await asyncio.to_thread(self._delete, evicted)
+
+    async def image(
+        self,
+        api: Any,
+        endpoint: Endpoints,
+        method: str = 'post',
+        /,
+        *,
+        json: dict[str, Any],
+        slot: Optional[AsyncContextManager[Any]] = None
+    ) -> tuple[str, Union[str, io.IOBase]]:
+        """Returns the request's key and either a CDN link or a file to upload.
+
+        ``slot`` is entered only around the API call, so cached images are
+        never held up behind it.
+        """
+
+        key: str = image_key(endpoint, json)
+        url: Optional[str] = self.url(key)
+        if url is not None:
+            return key, url
+
+        image: Optional[io.IOBase] = await self.get(key)
+        if image is None:
+            async with slot or contextlib.nullcontext():
+                image = await api.image(endpoint, method, json=json)
+            if self.encoder is not None:
+                image = await self.encoder.encode(image)
+            await self.put(key, image)
+        return key, image
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'url_hits': self.url_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def close(self) -> None:
+        if self.encoder is not None:
+            self.encoder.close()
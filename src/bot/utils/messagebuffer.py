@@ -0,0 +1,195 @@
+from typing import Any, Iterable, Optional
+
+from collections import OrderedDict
+import asyncio
+import time
+
+import discord
+
+
+class ChannelBuffer:
+    __slots__ = ('messages', 'size', 'synced', 'reached_start', 'last_used', 'lock')
+
+    def __init__(self) -> None:
+        # message id -> content, oldest first
+        self.messages: OrderedDict[int, str] = OrderedDict()
+        self.size: int = 0
+        # every message from the oldest one here up to now has been seen
+        self.synced: bool = True
+        # history has nothing older than the oldest message here
+        self.reached_start: bool = False
+        self.last_used: float = time.monotonic()
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+    @property
+    def oldest(self) -> Optional[int]:
+        return next(iter(self.messages), None)
+
+    def clear(self) -> int:
+        freed: int = self.size
+        self.messages.clear()
+        self.size = 0
+        self.synced = True
+        self.reached_start = False
+        return freed
+
+
+class MessageBuffer:
+    """The recent message contents of channels wordcloud has been run in.
+
+    Once a channel is tracked, new, edited and deleted messages keep its
+    buffer current, so a rerun only asks Discord for messages older than
+    the ones it already has. Each channel keeps at most ``max_messages``,
+    and whole channels are dropped least recently used first past
+    ``max_channels`` or ``max_bytes`` and after ``idle_timeout`` unused.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_messages: int = 1000,
+        max_channels: int = 500,
+        max_bytes: int = 64 * 1024 * 1024,
+        idle_timeout: float = 6 * 3600,
+        sweep_interval: float = 300
+    ) -> None:
+        self.max_messages: int = max_messages
+        self.max_channels: int = max_channels
+        self.max_bytes: int = max_bytes
+        self.idle_timeout: float = idle_timeout
+        self.sweep_interval: float = sweep_interval
+        self.size: int = 0
+        self.buffered: int = 0
+        self.fetched: int = 0
+        self.evictions: int = 0
+        self._channels: OrderedDict[int, ChannelBuffer] = OrderedDict()
+        self._last_sweep: float = time.monotonic()
+
+    def add(self, message: discord.Message) -> None:
+        buffer: Optional[ChannelBuffer] = self._channels.get(message.channel.id)
+        if buffer is None or message.id in buffer.messages:
+            return
+        buffer.messages[message.id] = message.content
+        buffer.size += len(message.content)
+        self.size += len(message.content)
+        if len(buffer.messages) > self.max_messages:
+            _, content = buffer.messages.popitem(last=False)
+            buffer.size -= len(content)
+            self.size -= len(content)
+            buffer.reached_start = False
+        self._evict()
+
+    def edit(self, channel_id: int, message_id: int, content: str) -> None:
+        buffer: Optional[ChannelBuffer] = self._channels.get(channel_id)
+        if buffer is None or message_id not in buffer.messages:
+            return
+        change: int = len(content) - len(buffer.messages[message_id])
+        buffer.messages[message_id] = content
+        buffer.size += change
+        self.size += change
+
+    def delete(self, channel_id: int, message_ids: Iterable[int]) -> None:
+        buffer: Optional[ChannelBuffer] = self._channels.get(channel_id)
+        if buffer is None:
+            return
+        for message_id in message_ids:
+            content: Optional[str] = buffer.messages.pop(message_id, None)
+            if content is not None:
+                buffer.size -= len(content)
+                self.size -= len(content)
+
+    def invalidate(self) -> None:
+        # events may have been missed while disconnected, refetch on next use
+        for buffer in self._channels.values():
+            buffer.synced = False
+
+    def _drop(self, channel_id: int) -> None:
+        buffer: ChannelBuffer = self._channels.pop(channel_id)
+        self.size -= buffer.clear()
+        self.evictions += 1
+
+    def _evict(self) -> None:
+        for channel_id in list(self._channels):
+            if len(self._channels) <= self.max_channels and self.size <= self.max_bytes:
+                break
+            # a channel being backfilled is about to be used, leave it be
+            if not self._channels[channel_id].lock.locked():
+                self._drop(channel_id)
+
+    def sweep(self) -> None:
+        now: float = time.monotonic()
+        self._last_sweep = now
+        idle: list[int] = [
+            channel_id for channel_id, buffer in self._channels.items()
+            if now - buffer.last_used > self.idle_timeout and not buffer.lock.locked()
+        ]
+        for channel_id in idle:
+            self._drop(channel_id)
+
+    def channel(self, channel_id: int) -> ChannelBuffer:
+        if time.monotonic() - self._last_sweep > self.sweep_interval:
+            self.sweep()
+        buffer: Optional[ChannelBuffer] = self._channels.get(channel_id)
+        if buffer is None:
+            buffer = self._channels[channel_id] = ChannelBuffer()
+        self._channels.move_to_end(channel_id)
+        buffer.last_used = time.monotonic()
+        return buffer
+
+    def _prepend(self, buffer: ChannelBuffer, message_id: int, content: str) -> bool:
+        if message_id in buffer.messages:
+            # arrived through on_message while the history was being read
+            return True
+        if len(buffer.messages) >= self.max_messages:
+            return False
+        buffer.messages[message_id] = content
+        buffer.messages.move_to_end(message_id, last=False)
+        buffer.size += len(content)
+        self.size += len(content)
+        return True
+
+    async def contents(self, channel: discord.abc.Messageable, limit: int) -> list[str]:
+        contents, _ = await self.window(channel, limit)
+        return contents
+
+    async def window(self, channel: discord.abc.Messageable, limit: int) -> tuple[list[str], Optional[int]]:
+        """Returns the contents of the latest ``limit`` messages, oldest first,
+        and the id of the oldest one.
+
+        Only the messages older than the buffer's oldest are read from the
+        channel history. At most ``max_messages`` are returned.
+        """
+
+        buffer: ChannelBuffer = self.channel(channel.id)
+        async with buffer.lock:
+            if not buffer.synced:
+                self.size -= buffer.clear()
+
+            missing: int = min(limit, self.max_messages) - len(buffer.messages)
+            self.buffered += min(limit, len(buffer.messages))
+            if missing > 0 and not buffer.reached_start:
+                oldest: Optional[int] = buffer.oldest
+                before: Optional[discord.Object] = discord.Object(id=oldest) if oldest else None
+                fetched: int = 0
+                async for message in channel.history(limit=missing, before=before):
+                    fetched += 1
+                    if not self._prepend(buffer, message.id, message.content):
+                        break
+                else:
+                    buffer.reached_start = fetched < missing
+                self.fetched += fetched
+
+            window: list[tuple[int, str]] = list(buffer.messages.items())[-limit:]
+        self._evict()
+        return [content for _, content in window], window[0][0] if window else None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'channels': len(self._channels),
+            'messages': sum(len(buffer.messages) for buffer in self._channels.values()),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'from_buffer': self.buffered,
+            'from_history': self.fetched,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,202 @@
+from typing import Any, Awaitable, Callable, Optional
+
+from collections import deque
+import asyncio
+import json as JSON
+import logging
+import os
+import random
+import time
+
+import discord
+
+from .dispatch import current_priority, low
+from .enums import Endpoints
+
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# the moderation model only looks at the start of long messages anyway
+moderation_max_chars: int = 2000
+
+
+class PendingMessage:
+    __slots__ = ('guild_id', 'channel_id', 'message_id', 'author_id', 'author', 'content', 'jump_url', 'queued')
+
+    def __init__(self, message: discord.Message) -> None:
+        self.guild_id: Optional[int] = message.guild.id if message.guild else None
+        self.channel_id: int = message.channel.id
+        self.message_id: int = message.id
+        self.author_id: int = message.author.id
+        self.author: str = str(message.author)
+        self.content: str = message.content[:moderation_max_chars]
+        self.jump_url: str = message.jump_url
+        self.queued: float = time.monotonic()
+
+
+Reporter = Callable[[PendingMessage, dict[str, Any]], Awaitable[Any]]
+
+
+class ModerationPipeline:
+    """Checks chat messages with ai_moderation_text in batches.
+
+    Nothing is checked by default. A guild opts in by setting the channel
+    its own flagged messages are reported to. Messages wait until ``max_batch`` of them are queued or the oldest has
+    waited ``window`` seconds, then go out in one call, with a single batch
+    in flight at a time. Once ``max_queue`` messages are waiting, a new
+    message replaces a random queued one ``sample_rate`` of the time and is
+    dropped otherwise, so a flood is sampled instead of backing up.
+    """
+
+    def __init__(
+        self,
+        path: str = 'moderation_channels.json',
+        *,
+        max_batch: int = 32,
+        window: float = 2.0,
+        max_queue: int = 512,
+        sample_rate: float = 0.25,
+        threshold: float = 0.5
+    ) -> None:
+        self.max_batch: int = max_batch
+        self.window: float = window
+        self.max_queue: int = max_queue
+        self.sample_rate: float = sample_rate
+        self.threshold: float = threshold
+        self.path: str = path
+        # guild id -> the channel that guild's flagged messages are reported to
+        self.channels: dict[int, int] = {}
+        self.submitted: int = 0
+        self.dropped: int = 0
+        self.sampled: int = 0
+        self.checked: int = 0
+        self.flagged: int = 0
+        self.batches: int = 0
+        self.failures: int = 0
+        self.total_lag: float = 0.0
+        self._queue: deque[PendingMessage] = deque()
+        self._ready: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._rng: random.Random = random.Random()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding='utf-8') as fp:
+                self.channels = {int(guild_id): int(channel_id) for guild_id, channel_id in JSON.load(fp).items()}
+        except FileNotFoundError:
+            self.channels = {}
+
+    def _save(self, channels: dict[str, int]) -> None:
+        temp: str = f'{self.path}.tmp'
+        with open(temp, 'w', encoding='utf-8') as fp:
+            JSON.dump(channels, fp)
+        os.replace(temp, self.path)
+
+    async def load(self) -> None:
+        await asyncio.to_thread(self._load)
+
+    async def set_channel(self, guild_id: int, channel_id: Optional[int]) -> None:
+        if channel_id is None:
+            self.channels.pop(guild_id, None)
+        else:
+            self.channels[guild_id] = channel_id
+        await asyncio.to_thread(self._save, {str(guild_id): channel_id for guild_id, channel_id in self.channels.items()})
+
+    def report_channel(self, guild_id: Optional[int]) -> Optional[int]:
+        return self.channels.get(guild_id) if guild_id is not None else None
+
+    def submit(self, message: discord.Message) -> bool:
+        if not message.content or message.guild is None or message.guild.id not in self.channels:
+            return False
+        self.submitted += 1
+
+        if len(self._queue) >= self.max_queue:
+            if self._rng.random() >= self.sample_rate:
+                self.dropped += 1
+                return False
+            # keeps a spread of the flood rather than only its oldest part
+            self._queue[self._rng.randrange(len(self._queue))] = PendingMessage(message)
+            self.sampled += 1
+            self.dropped += 1
+            return True
+
+        self._queue.append(PendingMessage(message))
+        if len(self._queue) == 1 or len(self._queue) >= self.max_batch:
+            self._ready.set()
+        return True
+
+    def start(self, api: Any, report: Reporter) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._worker(api, report))
+
+    def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    async def _next_batch(self) -> list[PendingMessage]:
+        while not self._queue:
+            self._ready.clear()
+            await self._ready.wait()
+
+        waited: float = time.monotonic() - self._queue[0].queued
+        if len(self._queue) < self.max_batch and waited < self.window:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=self.window - waited)
+            except TimeoutError:
+                pass
+
+        count: int = min(self.max_batch, len(self._queue))
+        return [self._queue.popleft() for _ in range(count)]
+
+    async def _worker(self, api: Any, report: Reporter) -> None:
+        # moderation is background work, user commands go first
+        current_priority.set(low)
+        while True:
+            batch: list[PendingMessage] = await self._next_batch()
+            try:
+                await self.check(api, report, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # not retried, a backlog of stale messages is worth less than fresh ones
+                self.failures += 1
+                log.exception('Moderation batch of %s messages failed', len(batch))
+
+    async def check(self, api: Any, report: Reporter, batch: list[PendingMessage]) -> None:
+        body: dict[str, Any] = await api.json(
+            Endpoints.ai_moderation_text, 'post', json={'input': [pending.content for pending in batch]}
+        )
+        results: list[Any] = body.get('results') or []
+        if len(results) != len(batch):
+            raise ValueError(f'Expected {len(batch)} moderation results, got {len(results)}')
+
+        now: float = time.monotonic()
+        self.batches += 1
+        self.checked += len(batch)
+        self.total_lag += sum(now - pending.queued for pending in batch)
+        for pending, result in zip(batch, results):
+            if not isinstance(result, dict):
+                continue
+            if result.get('flagged') or float(result.get('score') or 0) >= self.threshold:
+                self.flagged += 1
+                try:
+                    await report(pending, result)
+                except discord.HTTPException:
+                    log.exception('Could not report flagged message %s', pending.message_id)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'guilds': len(self.channels),
+            'queued': len(self._queue),
+            'max_queue': self.max_queue,
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+            'sampled': self.sampled,
+            'checked': self.checked,
+            'flagged': self.flagged,
+            'batches': self.batches,
+            'avg_batch': self.checked / self.batches if self.batches else 0.0,
+            'avg_lag': self.total_lag / self.checked if self.checked else 0.0,
+            'failures': self.failures,
+        }
@@ -0,0 +1,262 @@
+from typing import Any, Optional
+
+import asyncio
+import json as JSON
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from .dispatch import current_priority, high
+from .enums import Endpoints, api_headers
+
+
+log: logging.Logger = logging.getLogger(__name__)
+
+# endpoints that are queued instead of lost when the API is unreachable,
+# and how long a queued call is still worth replaying
+outbox_ttls: dict[Endpoints, float] = {
+    Endpoints.iisr_temp_ban_create: 24 * 3600,
+    Endpoints.iisr_perm_ban_create: 24 * 3600,
+    Endpoints.iisr_temp_ban_all_servers: 24 * 3600,
+    Endpoints.iisr_perm_ban_all_servers: 24 * 3600,
+    Endpoints.iisr_ban_remove: 24 * 3600,
+    Endpoints.iisr_ban_remove_all_servers: 24 * 3600,
+    Endpoints.iisr_server_shutdown: 15 * 60,
+    Endpoints.iisr_server_lock: 15 * 60,
+    Endpoints.iisr_server_unlock: 15 * 60,
+    Endpoints.roguessr_server_shutdown: 15 * 60,
+}
+
+# statuses that mean the API did not get to apply the call
+transient_statuses: frozenset[int] = frozenset({429, 500, 502, 503, 504})
+
+schema: str = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    endpoint TEXT NOT NULL,
+    method TEXT NOT NULL,
+    json TEXT NOT NULL,
+    params TEXT NOT NULL,
+    mod TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, next_attempt);
+'''
+
+
+class OutboxEntry:
+    def __init__(self, row: sqlite3.Row) -> None:
+        self.id: int = row['id']
+        self.key: str = row['key']
+        self.endpoint: Endpoints = Endpoints[row['endpoint']]
+        self.method: str = row['method']
+        self.json: dict[str, Any] = JSON.loads(row['json'])
+        self.params: dict[str, Any] = JSON.loads(row['params'])
+        self.mod: Optional[str] = row['mod']
+        self.status: str = row['status']
+        self.attempts: int = row['attempts']
+        self.created: float = row['created']
+        self.expires: float = row['expires']
+        self.next_attempt: float = row['next_attempt']
+        self.last_error: Optional[str] = row['last_error']
+
+
+def receipt(entry_id: Optional[int]) -> str:
+    if entry_id is None:
+        return 'done'
+    return f'The API is unreachable, queued as #{entry_id} and it will be applied once the API recovers'
+
+
+def describe(entries: list[OutboxEntry], *, limit: int = 20) -> str:
+    now: float = time.time()
+    lines: list[str] = []
+    for entry in entries[:limit]:
+        target: str = str(entry.json.get('username') or entry.json.get('id') or '-')
+        due: float = max(0.0, entry.next_attempt - now)
+        lines.append(
+            f'#{entry.id:<5}{entry.endpoint.name:<28}{target:<20}'
+            f'by {entry.mod or "?"}, {entry.attempts} attempts, next in {due:.0f}s'
+        )
+        if entry.last_error:
+            lines.append(f'      last error: {entry.last_error[:80]}')
+    if len(entries) > limit:
+        lines.append(f'... and {len(entries) - limit} more')
+    return '\n'.join(lines)
+
+
+class Outbox:
+    def __init__(
+        self,
+        path: str = 'outbox.db',
+        *,
+        base_delay: float = 5.0,
+        max_delay: float = 300.0,
+        poll_interval: float = 5.0
+    ) -> None:
+        self.path: str = path
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.poll_interval: float = poll_interval
+        self.replayed: int = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock: threading.Lock = threading.Lock()
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def new_key() -> str:
+        return uuid.uuid4().hex
+
+    def _connect(self) -> None:
+        db: sqlite3.Connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        # WAL keeps appends cheap, synchronous=FULL fsyncs every commit
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=FULL')
+        db.executescript(schema)
+        self._db = db
+
+    def _execute(self, query: str, args: tuple = ()) -> list[sqlite3.Row]:
+        assert self._db is not None
+        with self._lock:
+            cursor: sqlite3.Cursor = self._db.execute(query, args)
+            return cursor.fetchall()
+
+    async def execute(self, query: str, *args: Any) -> list[sqlite3.Row]:
+        return await asyncio.to_thread(self._execute, query, args)
+
+    async def open(self) -> None:
+        await asyncio.to_thread(self._connect)
+
+    def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    async def add(
+        self,
+        key: str,
+        endpoint: Endpoints,
+        method: str,
+        *,
+        json: dict[str, Any],
+        params: dict[str, Any]
+    ) -> int:
+        now: float = time.time()
+        rows: list[sqlite3.Row] = await self.execute(
+            'INSERT INTO outbox (key, endpoint, method, json, params, mod, created, expires, next_attempt) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET key = excluded.key RETURNING id',
+            key,
+            endpoint.name,
+            method,
+            JSON.dumps(json),
+            JSON.dumps(params),
+            params.get('mod'),
+            now,
+            now + outbox_ttls.get(endpoint, 3600),
+            now + self.base_delay
+        )
+        return rows[0]['id']
+
+    async def pending(self, group: Optional[str] = None) -> list[OutboxEntry]:
+        rows: list[sqlite3.Row] = await self.execute("SELECT * FROM outbox WHERE status = 'pending' ORDER BY id")
+        entries: list[OutboxEntry] = [OutboxEntry(row) for row in rows]
+        if group:
+            entries = [entry for entry in entries if entry.endpoint.group == group]
+        return entries
+
+    async def has_pending(self, group: str) -> bool:
+        return bool(await self.pending(group))
+
+    async def mark(self, entry: OutboxEntry, status: str, error: Optional[str] = None) -> None:
+        await self.execute(
+            'UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = ? WHERE id = ?',
+            status, error, entry.id
+        )
+
+    async def defer(self, entry: OutboxEntry, error: str, retry_after: Optional[float] = None) -> None:
+        ceiling: float = min(self.max_delay, self.base_delay * (2 ** entry.attempts))
+        delay: float = max(retry_after or 0.0, random.uniform(ceiling / 2, ceiling))
+        await self.execute(
+            'UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt = ? WHERE id = ?',
+            error, time.time() + delay, entry.id
+        )
+
+    async def cancel(self, entry_id: int) -> bool:
+        rows: list[sqlite3.Row] = await self.execute(
+            "UPDATE outbox SET status = 'cancelled' WHERE id = ? AND status = 'pending' RETURNING id", entry_id
+        )
+        return bool(rows)
+
+    def start(self, functions) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._replayer(functions))
+
+    def wakeup(self) -> None:
+        self._wakeup.set()
+
+    async def _replayer(self, functions) -> None:
+        # queued moderation actions go out ahead of regular traffic
+        current_priority.set(high)
+        while True:
+            try:
+                await self.replay(functions)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('Outbox replay failed')
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except TimeoutError:
+                pass
+
+    async def replay(self, functions) -> None:
+        now: float = time.time()
+        blocked: set[str] = set()
+        for entry in await self.pending():
+            group: str = entry.endpoint.group
+            # keep each group in order, a later unban must not overtake its ban
+            if group in blocked:
+                continue
+            if entry.expires <= now:
+                await self.mark(entry, 'expired', entry.last_error)
+                continue
+            if entry.next_attempt > now:
+                blocked.add(group)
+                continue
+
+            headers: dict[str, Any] = {**api_headers, 'Idempotency-Key': entry.key}
+            try:
+                status, reason, body = await functions.endpoint_request(
+                    entry.endpoint, entry.method, headers=headers, json=entry.json, params=entry.params
+                )
+            except Exception as e:
+                await self.defer(entry, f'{e.__class__.__name__}: {e}')
+                blocked.add(group)
+                continue
+
+            if status in functions.bot.variables['ok_status_codes']:
+                await self.mark(entry, 'done')
+                self.replayed += 1
+                log.info('Replayed outbox entry %s (%s)', entry.id, entry.endpoint.name)
+            elif status in transient_statuses:
+                breaker = functions.breaker(entry.endpoint)
+                await self.defer(entry, f'{status} {reason}', breaker.retry_after)
+                blocked.add(group)
+            else:
+                await self.mark(entry, 'failed', f'{status} {reason}: {body}'[:500])
+                log.warning('Outbox entry %s was rejected with %s', entry.id, status)
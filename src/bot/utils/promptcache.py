@@ -0,0 +1,89 @@
+from typing import Any, Optional
+
+import asyncio
+import hashlib
+import json as JSON
+import os
+import re
+
+from .cache import TTLCache
+from .enums import Endpoints
+
+
+prompt_cache_ttl: float = 3600
+# answers longer than this are rare and not worth the space
+prompt_cache_max_answer: int = 16 * 1024
+
+whitespace = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt: str) -> str:
+    # "Hello!", "hello" and "  hello  " are the same question
+    return whitespace.sub(' ', prompt).strip().casefold().rstrip('!?.')
+
+
+def prompt_key(endpoint: Endpoints, prompt: str, params: dict[str, Any]) -> str:
+    options: dict[str, Any] = {key: value for key, value in params.items() if key not in ('prompt', 'stream')}
+    raw: str = JSON.dumps([endpoint.name, normalize_prompt(prompt), options], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class PromptCache:
+    def __init__(
+        self,
+        path: str = 'prompt_cache_optin.json',
+        *,
+        enabled: bool = False,
+        max_entries: int = 2048,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = prompt_cache_ttl
+    ) -> None:
+        self.path: str = path
+        self.enabled: bool = enabled
+        self.ttl: float = ttl
+        self.cache: TTLCache = TTLCache(max_entries=max_entries, max_bytes=max_bytes)
+        # guilds that asked for repeated prompts to be answered from the cache
+        self.opted_in: set[int] = set()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding='utf-8') as fp:
+                self.opted_in = {int(guild_id) for guild_id in JSON.load(fp)}
+        except FileNotFoundError:
+            self.opted_in = set()
+
+    def _save(self, guild_ids: list[int]) -> None:
+        temp: str = f'{self.path}.tmp'
+        with open(temp, 'w', encoding='utf-8') as fp:
+            JSON.dump(guild_ids, fp)
+        os.replace(temp, self.path)
+
+    async def load(self) -> None:
+        await asyncio.to_thread(self._load)
+
+    async def set_opt_in(self, guild_id: int, opted_in: bool) -> None:
+        if opted_in:
+            self.opted_in.add(guild_id)
+        else:
+            self.opted_in.discard(guild_id)
+        await asyncio.to_thread(self._save, sorted(self.opted_in))
+
+    def active(self, guild_id: Optional[int]) -> bool:
+        return self.enabled and guild_id in self.opted_in
+
+    def get(self, guild_id: Optional[int], endpoint: Endpoints, params: dict[str, Any]) -> Optional[str]:
+        if not self.active(guild_id):
+            return None
+        return self.cache.get(prompt_key(endpoint, str(params.get('prompt', '')), params))
+
+    def set(self, guild_id: Optional[int], endpoint: Endpoints, params: dict[str, Any], answer: str) -> None:
+        if not self.active(guild_id) or not answer or len(answer) > prompt_cache_max_answer:
+            return
+        key: str = prompt_key(endpoint, str(params.get('prompt', '')), params)
+        self.cache.set(key, answer, self.ttl, tag=endpoint)
+
+    def stats(self) -> dict[str, Any]:
+        stats: dict[str, Any] = self.cache.stats()
+        stats['enabled'] = self.enabled
+        stats['opted_in'] = len(self.opted_in)
+        return stats
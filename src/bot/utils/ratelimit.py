@@ -0,0 +1,167 @@
+from typing import Any, Mapping, Optional
+
+import asyncio
+import os
+import time
+
+from .enums import Endpoints
+from .retry import parse_retry_after
+
+
+def parse_rate_limits(value: str) -> dict[str, tuple[float, int]]:
+    # "ai=2/5,iisr=10/20" is 2 requests a second with a burst of 5 for ai, and so on
+    limits: dict[str, tuple[float, int]] = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        group, _, limit = item.partition('=')
+        rate, _, burst = limit.partition('/')
+        limits[group.strip()] = (float(rate), int(burst or max(1, float(rate))))
+    return limits
+
+
+# (requests per second, burst) per endpoint group, set with RAC_RATE_LIMITS; a group
+# without one is not throttled until the API answers 429 or runs out of X-RateLimit-Remaining
+rate_limits: dict[str, tuple[float, int]] = parse_rate_limits(os.environ.get('RAC_RATE_LIMITS', ''))
+default_rate_limit: Optional[tuple[float, int]] = None
+
+
+def parse_reset(headers: Mapping[str, str]) -> Optional[float]:
+    reset_after: Optional[float] = parse_retry_after(headers.get('X-RateLimit-Reset-After'))
+    if reset_after is not None:
+        return reset_after
+
+    reset: Optional[str] = headers.get('X-RateLimit-Reset')
+    if reset is None:
+        return None
+    try:
+        value: float = float(reset)
+    except ValueError:
+        return None
+    # epoch seconds, some APIs send a delta in the same header instead
+    return max(0.0, value - time.time()) if value > 1e9 else value
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: Optional[float] = None, burst: int = 0) -> None:
+        # without a rate the bucket only waits out the blocks the API asks for
+        self.name: str = name
+        self.rate: Optional[float] = rate
+        self.capacity: float = float(burst)
+        self.tokens: float = float(burst)
+        self.updated: float = time.monotonic()
+        self.blocked_until: float = 0.0
+        self.waiting: int = 0
+        self.acquired: int = 0
+        self.delayed: int = 0
+        self.throttled: int = 0
+        self.total_wait: float = 0.0
+        self.max_wait: float = 0.0
+        # asyncio.Lock wakes waiters in order, so callers are served FIFO
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        if self.rate is None:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        now: float = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.rate is None or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> float:
+        started: float = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while (wait := self.delay()) > 0:
+                    await asyncio.sleep(wait)
+                if self.rate is not None:
+                    self.tokens -= 1
+        finally:
+            self.waiting -= 1
+
+        waited: float = time.monotonic() - started
+        self.acquired += 1
+        if waited > 0.001:
+            self.delayed += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def block(self, seconds: float) -> None:
+        now: float = time.monotonic()
+        self._refill(now)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def update(self, status: int, headers: Mapping[str, str]) -> None:
+        if status == 429:
+            self.throttled += 1
+            retry_after: Optional[float] = parse_retry_after(headers.get('Retry-After'))
+            if retry_after is None:
+                retry_after = parse_reset(headers)
+            if retry_after is None:
+                retry_after = 1 / self.rate if self.rate else 1.0
+            self.block(retry_after)
+            return
+
+        remaining: Optional[str] = headers.get('X-RateLimit-Remaining')
+        if remaining is None:
+            return
+        try:
+            left: float = float(remaining)
+        except ValueError:
+            return
+
+        if self.rate is not None:
+            self._refill(time.monotonic())
+            # the API's count wins when it has less left than the local estimate
+            self.tokens = min(self.tokens, left)
+        if left <= 0:
+            reset: Optional[float] = parse_reset(headers)
+            if reset:
+                self.block(reset)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'rate': self.rate,
+            'burst': int(self.capacity),
+            'tokens': round(self.tokens, 2),
+            'queued': self.waiting,
+            'acquired': self.acquired,
+            'delayed': self.delayed,
+            'throttled': self.throttled,
+            'avg_wait': self.total_wait / self.delayed if self.delayed else 0.0,
+            'max_wait': self.max_wait,
+            'blocked_for': max(0.0, self.blocked_until - time.monotonic()),
+        }
+
+
+class RateLimiter:
+    def __init__(self, limits: Optional[dict[str, tuple[float, int]]] = None) -> None:
+        self.limits: dict[str, tuple[float, int]] = limits if limits is not None else rate_limits
+        self.buckets: dict[str, TokenBucket] = {}
+
+    def bucket(self, endpoint: Endpoints) -> TokenBucket:
+        group: str = endpoint.group
+        bucket: Optional[TokenBucket] = self.buckets.get(group)
+        if bucket is None:
+            limit: Optional[tuple[float, int]] = self.limits.get(group, default_rate_limit)
+            bucket = self.buckets[group] = TokenBucket(group, *limit) if limit else TokenBucket(group)
+        return bucket
+
+    async def acquire(self, endpoint: Endpoints) -> float:
+        return await self.bucket(endpoint).acquire()
+
+    def update(self, endpoint: Endpoints, status: int, headers: Mapping[str, str]) -> None:
+        self.bucket(endpoint).update(status, headers)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        return {name: bucket.to_dict() for name, bucket in sorted(self.buckets.items())}
@@ -0,0 +1,155 @@
+from typing import Any, Optional
+
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import io
+import logging
+import multiprocessing
+import time
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+log: logging.Logger = logging.getLogger(__name__)
+
+encode_formats: tuple[str, ...] = ('webp', 'png', 'jpeg')
+
+
+def encode_image(data: bytes, format: str, quality: int, max_side: int) -> bytes:
+    # runs in a worker process, so it must stay a plain module-level function
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        options: dict[str, Any] = {}
+        if format == 'webp':
+            options = {'quality': quality, 'method': 4}
+        elif format == 'jpeg':
+            options = {'quality': quality, 'optimize': True, 'progressive': True}
+        elif format == 'png':
+            options = {'optimize': True}
+
+        out: io.BytesIO = io.BytesIO()
+        image.save(out, format=format.upper(), **options)
+        return out.getvalue()
+
+
+class EncodeStats:
+    def __init__(self) -> None:
+        self.encoded: int = 0
+        self.kept: int = 0
+        self.timeouts: int = 0
+        self.failures: int = 0
+        self.bytes_in: int = 0
+        self.bytes_out: int = 0
+        self.total_time: float = 0.0
+        self.max_time: float = 0.0
+
+    def record(self, before: int, after: int, seconds: float) -> None:
+        self.encoded += 1
+        self.bytes_in += before
+        self.bytes_out += after
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'encoded': self.encoded,
+            'kept': self.kept,
+            'timeouts': self.timeouts,
+            'failures': self.failures,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.bytes_out / self.bytes_in if self.bytes_in else 0.0,
+            'avg_ms': self.total_time / self.encoded * 1000 if self.encoded else 0.0,
+            'max_ms': self.max_time * 1000,
+        }
+
+
+class ImageEncoder:
+    """Re-encodes images in a process pool before they are uploaded.
+
+    The original is kept when Pillow cannot read it, when it is bigger than
+    ``max_input``, when the encode misses ``deadline`` or when the result is
+    not smaller.
+    """
+
+    def __init__(
+        self,
+        format: str = 'webp',
+        *,
+        quality: int = 80,
+        max_side: int = 1024,
+        max_input: int = 16 * 1024 * 1024,
+        deadline: float = 5.0,
+        workers: int = 2
+    ) -> None:
+        if format not in encode_formats:
+            raise ValueError(f'Unknown image format {format!r}, expected one of {", ".join(encode_formats)}')
+        self.format: str = format
+        self.quality: int = quality
+        self.max_side: int = max_side
+        self.max_input: int = max_input
+        self.deadline: float = deadline
+        self.workers: int = workers
+        self.stats: EncodeStats = EncodeStats()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def executor(self) -> ProcessPoolExecutor:
+        # started on first use so a bot that never sends images spawns nothing;
+        # forking a process that runs an event loop and open sockets is unsafe,
+        # so workers come from a clean forkserver (spawn where there is none)
+        if self._executor is None:
+            method: str = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context(method)
+            )
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def encode(self, fp: io.IOBase) -> io.IOBase:
+        if not self.available:
+            return fp
+
+        start: int = fp.tell()
+        data: bytes = await asyncio.to_thread(fp.read, self.max_input + 1)
+        fp.seek(start)
+        if len(data) > self.max_input:
+            self.stats.kept += 1
+            return fp
+
+        loop = asyncio.get_running_loop()
+        started: float = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.deadline):
+                encoded: bytes = await loop.run_in_executor(
+                    self.executor(), encode_image, data, self.format, self.quality, self.max_side
+                )
+        except TimeoutError:
+            # the worker still finishes the job, its result is just ignored
+            self.stats.timeouts += 1
+            return fp
+        except Exception:
+            self.stats.failures += 1
+            log.exception('Could not re-encode a %s byte image', len(data))
+            return fp
+
+        self.stats.record(len(data), min(len(encoded), len(data)), time.perf_counter() - started)
+        if len(encoded) >= len(data):
+            self.stats.kept += 1
+            return fp
+        return io.BytesIO(encoded)
@@ -0,0 +1,71 @@
+from typing import Optional
+
+from collections import deque
+from email.utils import parsedate_to_datetime
+import datetime
+import random
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        *,
+        attempts: int = 1,
+        base_delay: float = 0.25,
+        max_delay: float = 4.0,
+        retry_statuses: frozenset[int] = frozenset({429, 502, 503, 504}),
+        hedge: bool = False,
+        hedge_delay: float = 0.5,
+        min_hedge_delay: float = 0.05
+    ) -> None:
+        self.attempts: int = attempts
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.retry_statuses: frozenset[int] = retry_statuses
+        self.hedge: bool = hedge
+        self.hedge_delay: float = hedge_delay
+        self.min_hedge_delay: float = min_hedge_delay
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter, so callers that failed together do not retry together
+        ceiling: float = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+no_retry: RetryPolicy = RetryPolicy(attempts=1)
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 200, min_samples: int = 20) -> None:
+        self.min_samples: int = min_samples
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered: list[float] = sorted(self._samples)
+        index: int = min(len(ordered) - 1, int(len(ordered) * fraction))
+        return ordered[index]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when: datetime.datetime = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
@@ -0,0 +1,199 @@
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from collections import OrderedDict, deque
+import asyncio
+import contextlib
+import time
+
+import discord
+
+from .exceptions import HTTPException
+
+
+class AIJob:
+    __slots__ = ('user_id', 'guild_id', 'message_id', 'task', 'future', 'enqueued', 'started')
+
+    def __init__(self, user_id: int, guild_id: Optional[int], message_id: int) -> None:
+        self.user_id: int = user_id
+        self.guild_id: Optional[int] = guild_id
+        self.message_id: int = message_id
+        self.task: Optional[asyncio.Task] = asyncio.current_task()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued: float = time.monotonic()
+        self.started: Optional[float] = None
+
+
+class FairScheduler:
+    """Runs at most ``concurrency`` AI jobs at once and queues the rest.
+
+    Queued jobs are picked round-robin, first across guilds and then across
+    the users within a guild, so one busy server or one user cannot take
+    every turn.
+    """
+
+    def __init__(
+        self,
+        *,
+        concurrency: int = 4,
+        max_queue: int = 50,
+        max_per_user: int = 3,
+        update_interval: float = 2.0
+    ) -> None:
+        self.concurrency: int = concurrency
+        self.max_queue: int = max_queue
+        self.max_per_user: int = max_per_user
+        self.update_interval: float = update_interval
+        self.running: dict[int, AIJob] = {}
+        self.queued: int = 0
+        self.completed: int = 0
+        self.cancelled: int = 0
+        self.rejected: int = 0
+        self.total_wait: float = 0.0
+        self._queues: OrderedDict[Optional[int], OrderedDict[int, deque[AIJob]]] = OrderedDict()
+        self._jobs: dict[int, AIJob] = {}
+
+    def _round_robin(self, *, pop: bool) -> Iterator[AIJob]:
+        if pop:
+            queues = self._queues
+        else:
+            queues = OrderedDict(
+                (guild, OrderedDict((user, deque(jobs)) for user, jobs in users.items()))
+                for guild, users in self._queues.items()
+            )
+
+        while queues:
+            guild, users = next(iter(queues.items()))
+            user, jobs = next(iter(users.items()))
+            job: AIJob = jobs.popleft()
+            if jobs:
+                users.move_to_end(user)
+            else:
+                del users[user]
+            if users:
+                queues.move_to_end(guild)
+            else:
+                del queues[guild]
+            yield job
+
+    def position(self, job: AIJob) -> int:
+        for index, queued in enumerate(self._round_robin(pop=False), 1):
+            if queued is job:
+                return index
+        return 0
+
+    def _remove(self, job: AIJob) -> None:
+        users: Optional[OrderedDict[int, deque[AIJob]]] = self._queues.get(job.guild_id)
+        if users is None or job.user_id not in users:
+            return
+        jobs: deque[AIJob] = users[job.user_id]
+        if job in jobs:
+            jobs.remove(job)
+            self.queued -= 1
+        if not jobs:
+            del users[job.user_id]
+        if not users:
+            del self._queues[job.guild_id]
+
+    def _start(self, job: AIJob) -> None:
+        job.started = time.monotonic()
+        self.total_wait += job.started - job.enqueued
+        self.running[job.message_id] = job
+
+    def _dispatch(self) -> None:
+        while len(self.running) < self.concurrency and self._queues:
+            job: AIJob = next(self._round_robin(pop=True))
+            self.queued -= 1
+            if job.future.done():
+                continue
+            self._start(job)
+            job.future.set_result(None)
+
+    def _enqueue(self, job: AIJob) -> None:
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(429, 'The AI queue is full, try again in a bit')
+        users: OrderedDict[int, deque[AIJob]] = self._queues.setdefault(job.guild_id, OrderedDict())
+        jobs: deque[AIJob] = users.setdefault(job.user_id, deque())
+        if len(jobs) >= self.max_per_user:
+            self.rejected += 1
+            raise HTTPException(429, f'You already have {len(jobs)} AI requests queued')
+        jobs.append(job)
+        self.queued += 1
+
+    async def _wait(self, ctx: Any, job: AIJob) -> None:
+        notice: Optional[discord.Message] = None
+        shown: int = 0
+        try:
+            while True:
+                position: int = self.position(job)
+                if position and position != shown:
+                    content: str = f'You are #{position} in the AI queue...'
+                    try:
+                        if notice is None:
+                            notice = await ctx.reply(content)
+                        else:
+                            notice = await notice.edit(content=content)
+                    except discord.HTTPException:
+                        pass
+                    shown = position
+                try:
+                    await asyncio.wait_for(asyncio.shield(job.future), timeout=self.update_interval)
+                    return
+                except TimeoutError:
+                    continue
+        finally:
+            if notice is not None:
+                with contextlib.suppress(discord.HTTPException):
+                    await notice.delete()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, ctx: Any) -> AsyncIterator[AIJob]:
+        job = AIJob(ctx.author.id, ctx.guild.id if ctx.guild else None, ctx.message.id)
+        self._jobs[job.message_id] = job
+        try:
+            if len(self.running) < self.concurrency and not self._queues:
+                self._start(job)
+            else:
+                self._enqueue(job)
+                try:
+                    await self._wait(ctx, job)
+                except asyncio.CancelledError:
+                    if job.future.done() and not job.future.cancelled():
+                        # started just as it was cancelled, give the turn back
+                        self.running.pop(job.message_id, None)
+                        self._dispatch()
+                    else:
+                        job.future.cancel()
+                        self._remove(job)
+                    raise
+            yield job
+        finally:
+            self._jobs.pop(job.message_id, None)
+            if self.running.pop(job.message_id, None) is not None:
+                self.completed += 1
+                self._dispatch()
+
+    def cancel(self, message_id: int, functions: Any = None) -> bool:
+        job: Optional[AIJob] = self._jobs.get(message_id)
+        if job is None or job.task is None or job.task.done():
+            return False
+        self.cancelled += 1
+        # a running job is mid-request, which must not count against the breaker
+        if job.message_id in self.running and functions is not None:
+            functions.abandon(job.task)
+        else:
+            job.task.cancel()
+        return True
+
+    def stats(self) -> dict[str, Any]:
+        started: int = self.completed + len(self.running)
+        return {
+            'running': len(self.running),
+            'concurrency': self.concurrency,
+            'queued': self.queued,
+            'max_queue': self.max_queue,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'rejected': self.rejected,
+            'avg_wait': self.total_wait / started if started else 0.0,
+        }
@@ -0,0 +1,161 @@
+from typing import Any, AsyncIterator, Callable, Optional
+
+import aiohttp
+import discord
+import time
+
+from . import codec
+
+
+message_limit: int = 2000
+# Discord allows about 5 edits per 5 seconds on a message, this stays well under
+edit_interval: float = 1.5
+
+
+def response_text(body: Any) -> str:
+    # gemini answers with {'response': ...}, cloudflare wraps it in 'result'
+    if not isinstance(body, dict):
+        return ''
+    if isinstance(body.get('result'), dict):
+        body = body['result']
+    return str(body.get('response') or '')
+
+
+def delta_text(data: str) -> str:
+    try:
+        event: Any = codec.loads(data)
+    except ValueError:
+        return data
+    return response_text(event)
+
+
+def split_text(text: str, limit: int = message_limit) -> tuple[str, str]:
+    """Splits ``text`` into a head of at most ``limit`` characters and the rest.
+
+    The cut is made at the last newline or space in the second half of the
+    head when there is one, so words are not broken across messages.
+    """
+
+    if len(text) <= limit:
+        return text, ''
+    cut: int = max(text.rfind('\n', limit // 2, limit), text.rfind(' ', limit // 2, limit))
+    if cut <= 0:
+        cut = limit
+    return text[:cut], text[cut:].lstrip()
+
+
+class EventStream:
+    """A server-sent events body, read one event at a time.
+
+    The response, and the connection slot it holds, are released once the
+    stream is exhausted or ``close`` is called.
+    """
+
+    def __init__(self, response: aiohttp.ClientResponse, release: Callable[[bool], None]) -> None:
+        self.response: aiohttp.ClientResponse = response
+        self._release: Optional[Callable[[bool], None]] = release
+
+    async def __aenter__(self) -> 'EventStream':
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close(failed=exc_info[0] is not None and issubclass(exc_info[0], aiohttp.ClientError))
+
+    def close(self, *, failed: bool = False) -> None:
+        if self._release is None:
+            return
+        # a half-read body cannot go back to the pool
+        if self.response.content.at_eof():
+            self.response.release()
+        else:
+            self.response.close()
+        self._release(failed)
+        self._release = None
+
+    async def events(self) -> AsyncIterator[str]:
+        data: list[str] = []
+        failed: bool = False
+        try:
+            async for raw in self.response.content:
+                line: str = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+                if line.startswith('data:'):
+                    data.append(line[5:].lstrip(' '))
+                    continue
+                if line or not data:
+                    continue
+
+                event: str = '\n'.join(data)
+                data = []
+                if event == '[DONE]':
+                    break
+                yield event
+        except aiohttp.ClientError:
+            failed = True
+            raise
+        finally:
+            self.close(failed=failed)
+
+    async def text(self) -> AsyncIterator[str]:
+        async for event in self.events():
+            delta: str = delta_text(event)
+            if delta:
+                yield delta
+
+
+class ProgressiveReply:
+    """Grows a reply as text arrives, editing at most every ``interval`` seconds.
+
+    Text past the message limit continues in follow-up messages, each one a
+    reply to the one before it.
+    """
+
+    def __init__(self, ctx, *, interval: float = edit_interval, limit: int = message_limit) -> None:
+        self.ctx = ctx
+        self.interval: float = interval
+        self.limit: int = limit
+        self.messages: list[discord.Message] = []
+        self.current: str = ''
+        self.pending: str = ''
+        self.text: str = ''
+        self.new_message: bool = True
+        self.last_edit: float = 0.0
+        self.started: float = time.monotonic()
+        self.first_token: Optional[float] = None
+
+    async def feed(self, delta: str) -> None:
+        if self.first_token is None:
+            self.first_token = time.monotonic() - self.started
+        self.pending += delta
+        self.text += delta
+        # the first words go out straight away, after that edits are throttled
+        if not self.messages or time.monotonic() - self.last_edit >= self.interval:
+            await self.flush()
+
+    async def flush(self) -> None:
+        content: str = self.current + self.pending
+        self.pending = ''
+        while len(content) > self.limit:
+            head, content = split_text(content, self.limit)
+            await self._show(head)
+            self.new_message, self.current = True, ''
+        await self._show(content)
+        self.last_edit = time.monotonic()
+
+    async def finish(self, suffix: str = '') -> list[discord.Message]:
+        self.pending += suffix
+        await self.flush()
+        return self.messages
+
+    async def _show(self, content: str) -> None:
+        if not content.strip():
+            return
+        if self.new_message:
+            if self.messages:
+                message: discord.Message = await self.messages[-1].reply(content)
+            else:
+                message = await self.ctx.reply(content)
+            self.messages.append(message)
+            self.new_message = False
+        elif content != self.current:
+            self.messages[-1] = await self.messages[-1].edit(content=content)
+        self.current = content
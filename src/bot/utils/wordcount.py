@@ -0,0 +1,82 @@
+from typing import Iterable, Optional
+
+from collections import Counter
+import asyncio
+import re
+
+
+# counting more text than this moves off the event loop
+offload_chars: int = 256 * 1024
+
+urls = re.compile(r'https?://\S+|www\.\S+')
+# user, role and channel mentions, custom emojis and timestamps
+markup = re.compile(r'<(?:@[!&]?|#|a?:\w+:|t:)\d+(?::\w)?>|:\w+:')
+# letters only, so digits, punctuation and unicode emojis fall away
+words = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+stop_words: frozenset[str] = frozenset('''
+a about above after again against all am an and any are aren't as at be because been before being below
+between both but by can can't cannot could couldn't did didn't do does doesn't doing don't down during each
+few for from further get got had hadn't has hasn't have haven't having he he'd he'll he's her here here's hers
+herself him himself his how how's i i'd i'll i'm i've if im in into is isn't it it's its itself just let's like
+lol me more most mustn't my myself no nor not now of off on once only or other ought our ours ourselves out
+over own same shan't she she'd she'll she's should shouldn't so some such than that that's the their theirs
+them themselves then there there's these they they'd they'll they're they've this those through to too under
+until up us very was wasn't we we'd we'll we're we've were weren't what what's when when's where where's which
+while who who's whom why why's will with won't would wouldn't yeah yes you you'd you'll you're you've your
+yours yourself yourselves
+'''.split())
+
+
+def tokenize(text: str) -> list[str]:
+    text = markup.sub(' ', urls.sub(' ', text.casefold()))
+    return [word for word in words.findall(text) if len(word) > 1 and word not in stop_words]
+
+
+class WordCounter:
+    """Word counts folded in one message at a time.
+
+    With ``max_distinct`` the rarest words are dropped whenever twice that
+    many are counted, which keeps memory flat over any number of messages
+    at the cost of slightly low counts for words near the cut.
+    """
+
+    def __init__(self, max_distinct: Optional[int] = None) -> None:
+        self.counts: Counter[str] = Counter()
+        self.messages: int = 0
+        self.max_distinct: Optional[int] = max_distinct
+
+    def update(self, text: str) -> None:
+        self.counts.update(tokenize(text))
+        self.messages += 1
+        self._prune()
+
+    def _prune(self) -> None:
+        if self.max_distinct and len(self.counts) > self.max_distinct * 2:
+            self.counts = Counter(dict(self.counts.most_common(self.max_distinct)))
+
+    def update_many(self, texts: Iterable[str]) -> None:
+        for text in texts:
+            self.update(text)
+
+    def merge(self, other: 'WordCounter') -> None:
+        self.counts.update(other.counts)
+        self.messages += other.messages
+        self._prune()
+
+    def top(self, limit: int) -> dict[str, int]:
+        return dict(self.counts.most_common(limit))
+
+
+def count_words(texts: Iterable[str], limit: int) -> dict[str, int]:
+    counter = WordCounter()
+    counter.update_many(texts)
+    return counter.top(limit)
+
+
+async def word_frequencies(texts: list[str], limit: int) -> dict[str, int]:
+    """Returns the ``limit`` most common words in ``texts``, most common first."""
+
+    if sum(len(text) for text in texts) > offload_chars:
+        return await asyncio.to_thread(count_words, texts, limit)
+    return count_words(texts, limit)
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+port: int = 8097
+os.environ['RAC_API_URL'] = f'http://127.0.0.1:{port}/'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'bot'))
+
+import aiohttp
+
+from standin import StandInSettings, serve
+from utils.enums import Endpoints
+from utils.functions import Functions
+from utils.http import ConnectorSettings, PoolStats, create_session
+
+
+class HedgeCancelTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        # slower than the ping hedge delay, so the first attempt is still waiting on it
+        self.runner = await serve('127.0.0.1', port, StandInSettings(latency=1.0, sigma=0.01, seed=0))
+        self.bot = SimpleNamespace(
+            connector_settings=ConnectorSettings(),
+            pool_stats=PoolStats(),
+            variables={'ok_status_codes': [200, 201, 204]}
+        )
+        self.bot.session = create_session(
+            self.bot.connector_settings, self.bot.pool_stats, timeout=aiohttp.ClientTimeout(total=30)
+        )
+        self.functions = Functions(self.bot)
+
+    async def asyncTearDown(self) -> None:
+        await self.bot.session.close()
+        await self.runner.cleanup()
+
+    async def test_cancel_during_hedge_delay(self) -> None:
+        task = asyncio.ensure_future(self.functions.endpoint_request(Endpoints.utility_ping))
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.functions.dispatcher.active, 1)
+        self.assertEqual(self.bot.pool_stats.in_use, 1)
+
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.functions.hedges, 0)
+        self.assertEqual(self.functions.dispatcher.active, 0)
+        self.assertEqual(self.bot.pool_stats.in_use, 0)
+        self.assertEqual(self.functions.breaker(Endpoints.utility_ping).failures, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()